@@ -0,0 +1,598 @@
+"""
+Benchmarks for `isinstance2` and `issubclass2`.
+
+Run the micro-benchmarks with `python bench_isinstance2.py`. Each one prints the time per call and, where it makes
+sense, the time per element of the checked object.
+
+Run the suite with `python bench_isinstance2.py --suite`. It checks flat and nested containers at sizes from 10 up to
+`--max-size` (10^7 is the largest), wide unions, large Literals, variadic tuples, generators, deep nesting and matrices
+of `issubclass2` checks. It reports the time per call and per element and the peak memory allocated by a check, and
+compares them to the baseline saved with `--save`, exiting with status 1 if any benchmark regressed.
+"""
+import argparse
+import array
+import gc
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+from dataclasses import dataclass
+from collections.abc import Iterable, Mapping
+from types import UnionType
+from typing import (
+    Any, Callable, Collection, Iterator, Literal, MutableMapping, NamedTuple, NotRequired, Optional, Sequence, Set,
+    TypedDict, TypeVar, Union, get_args, get_origin
+)
+
+from isinstance2 import (
+    CheckedDict, CheckedList, GenericAlias, checked, compile_checker, disable_check_profiling, disable_parallel_checks,
+    disable_result_cache, enable_check_profiling, enable_parallel_checks, enable_result_cache, isinstance2,
+    isinstance2_explain, isinstance2_iterative, isinstance2_json, isinstance2_many, isinstance2_sampled, issubclass2,
+    issubclass2_cache_clear, issubclass2_iterative, set_checked_enabled,
+)
+
+
+def bench(name: str, func: Callable[[], Any], elements: int = 1, repeat: int = 5) -> float:
+    """Time `func` and print the best time per call (and per element). Returns the best time per call."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    line = f"{name:<60} {best * 1e6:>12.2f} us/call"
+    if elements > 1:
+        line += f" {best / elements * 1e9:>10.2f} ns/element"
+    print(line)
+    return best
+
+
+def recursive_isinstance2(obj: Any, cls: Any) -> bool:
+    """
+    Reference implementation that re-dispatches on the hint for every element, as `isinstance2` did before hints were
+    compiled. Used as the baseline for the benchmarks.
+    """
+    if isinstance(cls, GenericAlias):
+        origin, args = get_origin(cls), get_args(cls)
+        if not args:
+            return True
+        if origin in (Union, UnionType):
+            return any(recursive_isinstance2(obj, arg) for arg in args)
+        if origin is Literal:
+            return any(obj == arg for arg in args)
+        if origin is tuple:
+            if not isinstance(obj, tuple):
+                return False
+            if Ellipsis in args:
+                return all(recursive_isinstance2(item, args[0]) for item in obj)
+            return len(obj) == len(args) and all(recursive_isinstance2(item, arg) for item, arg in zip(obj, args))
+        if issubclass(origin, Mapping):
+            return isinstance(obj, origin) and all(
+                recursive_isinstance2(key, args[0]) and recursive_isinstance2(value, args[1])
+                for key, value in obj.items()
+            )
+        if issubclass(origin, Iterable):
+            return isinstance(obj, origin) and all(recursive_isinstance2(item, args[0]) for item in obj)
+        raise TypeError(f"Did not find a checker for {origin}")
+    elif cls is Any:
+        return True
+    return isinstance(obj, cls)
+
+
+def bench_compiled_checkers() -> None:
+    print("== compiled checkers vs recursive dispatch ==")
+    hint = dict[str, list[tuple[int, float]]]
+    obj = {str(i): [(j, float(j)) for j in range(10)] for i in range(1_000)}
+    elements = 1_000 * (1 + 10 * 3)
+    checker = compile_checker(hint)
+    bench("recursive: dict[str, list[tuple[int, float]]]", lambda: recursive_isinstance2(obj, hint), elements)
+    bench("isinstance2: dict[str, list[tuple[int, float]]]", lambda: isinstance2(obj, hint), elements)
+    bench("compile_checker: dict[str, list[tuple[int, float]]]", lambda: checker(obj), elements)
+
+
+def bench_unions_and_literals() -> None:
+    print("== wide unions and large literals ==")
+    union = Union[bytes, bytearray, complex, float, str, list[int], dict[str, int], tuple[int, ...], None, int]
+    obj = [None, 1, "a", 2.0, b"b", (1, 2)] * 1_000
+    bench("recursive: list[<10-arm union>]", lambda: recursive_isinstance2(obj, list[union]), len(obj))
+    bench("isinstance2: list[<10-arm union>]", lambda: isinstance2(obj, list[union]), len(obj))
+
+    literal = Literal[tuple(f"value_{i}" for i in range(500))]
+    obj = [f"value_{i}" for i in range(0, 500, 7)] * 100
+    bench("recursive: list[<500-value Literal>]", lambda: recursive_isinstance2(obj, list[literal]), len(obj))
+    bench("isinstance2: list[<500-value Literal>]", lambda: isinstance2(obj, list[literal]), len(obj))
+
+
+def bench_homogeneous_containers() -> None:
+    print("== homogeneous primitive containers ==")
+    size = 100_000
+    ints = list(range(size))
+    mixed = [i if i % 2 else str(i) for i in range(size)]
+    for name, obj, hint in [
+        ("list[int]", ints, list[int]),
+        ("list[int | str]", mixed, list[int | str]),
+        ("Sequence[int] over array.array", array.array("q", ints), Sequence[int]),
+        ("Sequence[int] over memoryview", memoryview(array.array("q", ints)), Sequence[int]),
+        ("Sequence[float] over array.array", array.array("d", ints), Sequence[float]),
+    ]:
+        bench(f"recursive: {name}", lambda: recursive_isinstance2(obj, hint), size)
+        bench(f"isinstance2: {name}", lambda: isinstance2(obj, hint), size)
+    try:
+        import numpy
+    except ImportError:
+        print("(NumPy is not installed; skipping ndarray benchmarks)")
+    else:
+        obj = numpy.arange(size, dtype=float)
+        bench("recursive: Iterable[float] over numpy.ndarray", lambda: recursive_isinstance2(obj, Iterable[float]), size)
+        bench("isinstance2: Iterable[float] over numpy.ndarray", lambda: isinstance2(obj, Iterable[float]), size)
+
+
+def bench_sampling() -> None:
+    print("== sampled checks ==")
+    hint = list[dict[str, list[int]]]
+    for size in (1_000, 100_000):
+        obj = [{"a": list(range(10))} for _ in range(size)]
+        bench(f"isinstance2: list[dict[str, list[int]]], {size} items", lambda: isinstance2(obj, hint), size)
+        bench(
+            f"isinstance2_sampled(sample_size=10): {size} items",
+            lambda: isinstance2_sampled(obj, hint, sample_size=10, seed=0),
+        )
+
+
+def bench_deep_nesting() -> None:
+    print("== deep nesting: explicit stack vs recursion ==")
+    depth = 200
+    hint, obj = int, 1
+    for _ in range(depth):
+        hint, obj = list[hint], [obj]
+    bench(f"isinstance2: {depth} nested lists", lambda: isinstance2(obj, hint), depth)
+    bench(f"isinstance2_iterative: {depth} nested lists", lambda: isinstance2_iterative(obj, hint), depth)
+
+    def uncached(check: Callable[[Any, Any], bool]) -> Callable[[], bool]:
+        def run() -> bool:
+            issubclass2_cache_clear()
+            return check(list[hint], Sequence[hint | str])
+        return run
+
+    bench(f"issubclass2 (uncached): {depth} nested lists", uncached(issubclass2), depth)
+    bench(f"issubclass2_iterative (uncached): {depth} nested lists", uncached(issubclass2_iterative), depth)
+
+    # Far beyond the recursion limit, only the explicit-stack engine works
+    depth = 10_000
+    hint, obj = int, 1
+    for _ in range(depth):
+        hint, obj = list[hint], [obj]
+    bench(f"isinstance2_iterative: {depth} nested lists", lambda: isinstance2_iterative(obj, hint), depth)
+
+
+def bench_wide() -> None:
+    print("== wide shapes: explicit stack vs recursion ==")
+    hint = list[dict[str, tuple[int, ...]]]
+    obj = [{str(j): tuple(range(5)) for j in range(10)} for _ in range(1_000)]
+    elements = 1_000 * 10 * 7
+    bench("isinstance2: list[dict[str, tuple[int, ...]]]", lambda: isinstance2(obj, hint), elements)
+    bench("isinstance2_iterative: list[dict[str, tuple[int, ...]]]", lambda: isinstance2_iterative(obj, hint), elements)
+
+
+def bench_many() -> None:
+    print("== batches of records ==")
+    hint = dict[str, int | str | None]
+    records = [{"id": i, "name": str(i), "parent": None} for i in range(200_000)]
+    size = len(records)
+    bench("isinstance2 in a loop", lambda: [isinstance2(record, hint) for record in records], size, repeat=3)
+    bench("isinstance2_many", lambda: isinstance2_many(records, hint), size, repeat=3)
+    for executor in ("thread", "process"):
+        bench(
+            f"isinstance2_many(executor={executor!r})",
+            lambda: isinstance2_many(records, hint, executor=executor, chunk_size=20_000), size, repeat=3
+        )
+
+
+def bench_parallel() -> None:
+    print("== parallel checks of one large container ==")
+    hint = list[dict[str, float]]
+    rows = [{"x": float(i), "y": 0.5} for i in range(1_000_000)]
+    size = len(rows)
+    bench("isinstance2: list[dict[str, float]]", lambda: isinstance2(rows, hint), size, repeat=3)
+    for executor in ("thread", "process"):
+        enable_parallel_checks(threshold=100_000, executor=executor)
+        try:
+            bench(f"isinstance2 (parallel, executor={executor!r})", lambda: isinstance2(rows, hint), size, repeat=3)
+        finally:
+            disable_parallel_checks()
+
+
+def bench_result_cache() -> None:
+    print("== result cache for immutable values ==")
+    hint = tuple[tuple[str, int], ...]
+    config = tuple((str(i), i) for i in range(1_000))
+    bench("isinstance2: tuple[tuple[str, int], ...]", lambda: isinstance2(config, hint), len(config))
+    enable_result_cache()
+    try:
+        bench("isinstance2 (result cache): tuple[tuple[str, int], ...]", lambda: isinstance2(config, hint), len(config))
+    finally:
+        disable_result_cache()
+
+
+def bench_checked_containers() -> None:
+    print("== checked containers ==")
+    hint = dict[str, list[int]]
+    state = {str(i): list(range(100)) for i in range(1_000)}
+    checked_state = CheckedDict(hint, {key: CheckedList(list[int], value) for key, value in state.items()})
+    elements = 1_000 * 101
+    bench("isinstance2: dict[str, list[int]]", lambda: isinstance2(state, hint), elements)
+    bench("isinstance2: dict[str, list[int]] (CheckedDict)", lambda: isinstance2(checked_state, hint), elements)
+    bench("CheckedList.append", lambda: checked_state["0"].append(1))
+
+
+def bench_checked() -> None:
+    print("== @checked per-call overhead ==")
+
+    def scale(values: list[float], factor: float, label: str | None = None) -> list[float]:
+        return values
+
+    decorated = checked(scale)
+    set_checked_enabled(False)
+    try:
+        switched_off = checked(scale)
+    finally:
+        set_checked_enabled(True)
+    values = [1.0, 2.0, 3.0]
+    bench("undecorated call", lambda: scale(values, 2.0, label="x"))
+    bench("@checked call", lambda: decorated(values, 2.0, label="x"))
+    bench("@checked call (decorated while switched off)", lambda: switched_off(values, 2.0, label="x"))
+    set_checked_enabled(False)
+    try:
+        bench("@checked call (switched off after decorating)", lambda: decorated(values, 2.0, label="x"))
+    finally:
+        set_checked_enabled(True)
+
+
+class Event(TypedDict):
+    id: int
+    name: str
+    tags: list[str]
+    parent: NotRequired[int | None]
+
+
+@dataclass
+class Reading:
+    sensor: str
+    value: float
+    flags: tuple[int, ...]
+
+
+T = TypeVar("T")
+
+
+class Pairs(dict[str, T]):
+    pass
+
+
+class IntPairs(Pairs[int]):
+    pass
+
+
+def bench_user_generics() -> None:
+    print("== user generic classes ==")
+    cases = [
+        ("issubclass2: Pairs[int] vs Mapping[str, int]", Pairs[int], Mapping[str, int]),
+        ("issubclass2: IntPairs vs Mapping[str, int | None]", IntPairs, Mapping[str, int | None]),
+    ]
+    for name, cls, superclass in cases:
+        def uncached() -> bool:
+            issubclass2_cache_clear()
+            return issubclass2(cls, superclass)
+
+        bench(f"{name} (uncached)", uncached)
+        bench(name, lambda: issubclass2(cls, superclass))
+    obj = IntPairs({str(i): i for i in range(1_000)})
+    bench("isinstance2: IntPairs vs Pairs[int]", lambda: isinstance2(obj, Pairs[int]), len(obj) * 2)
+
+
+def bench_records() -> None:
+    print("== TypedDicts and dataclasses ==")
+    events = [{"id": i, "name": str(i), "tags": ["a", "b"], "parent": None} for i in range(10_000)]
+    readings = [Reading(str(i), float(i), (1, 2)) for i in range(10_000)]
+    bench("isinstance2: list[Event]", lambda: isinstance2(events, list[Event]), len(events))
+    bench("isinstance2: list[Reading]", lambda: isinstance2(readings, list[Reading]), len(readings))
+
+
+def bench_json() -> None:
+    print("== JSON documents: streaming vs json.loads ==")
+    hint = list[dict[str, int | str | None]]
+    document = json.dumps([{"id": i, "name": str(i), "parent": None} for i in range(10_000)]).encode()
+    elements = 10_000 * 7
+    bench("isinstance2(json.loads(...))", lambda: isinstance2(json.loads(document), hint), elements, repeat=3)
+    bench("isinstance2_json", lambda: isinstance2_json(document, hint), elements, repeat=3)
+
+
+def bench_explain() -> None:
+    print("== explaining a failure vs finding it by hand ==")
+    hint = list[dict[str, list[int]]]
+    payload = [{"items": list(range(10))} for _ in range(50_000)]
+    payload[-1] = {"items": [*range(9), "9"]}
+    elements = 50_000 * 12
+
+    def by_hand() -> str:
+        # Re-check sub-structures until the offending element is found, as one would without an explanation
+        for index, item in enumerate(payload):
+            if not isinstance2(item, hint.__args__[0]):
+                for key, values in item.items():
+                    for position, value in enumerate(values):
+                        if not isinstance2(value, int):
+                            return f"[{index}][{key!r}][{position}]"
+        return ""
+
+    bench("isinstance2", lambda: isinstance2(payload, hint), elements, repeat=3)
+    bench("isinstance2 + search by hand", lambda: isinstance2(payload, hint) or by_hand(), elements, repeat=3)
+    bench("isinstance2_explain", lambda: isinstance2_explain(payload, hint), elements, repeat=3)
+
+
+def bench_profiling() -> None:
+    print("== check profiling overhead ==")
+    hint = list[dict[str, list[int | str]]]
+    obj = [{str(j): [j, str(j)] for j in range(10)} for _ in range(1_000)]
+    elements = 1_000 * 10 * 3
+    bench("isinstance2: profiling off", lambda: isinstance2(obj, hint), elements)
+    enable_check_profiling()
+    try:
+        bench("isinstance2: profiling on", lambda: isinstance2(obj, hint), elements)
+    finally:
+        disable_check_profiling()
+
+
+BENCHMARKS = [
+    bench_compiled_checkers,
+    bench_unions_and_literals,
+    bench_homogeneous_containers,
+    bench_sampling,
+    bench_deep_nesting,
+    bench_wide,
+    bench_many,
+    bench_parallel,
+    bench_result_cache,
+    bench_checked_containers,
+    bench_checked,
+    bench_records,
+    bench_user_generics,
+    bench_json,
+    bench_explain,
+    bench_profiling,
+]
+
+class Case(NamedTuple):
+    """
+    A benchmark of the suite, run once per size.
+
+    Attributes:
+        name: The name of the benchmark.
+        sizes: The sizes to run it at: the number of elements, or the depth for nested hints.
+        build: Builds the benchmark for a size. Returns a function to time and the number of elements it visits.
+    """
+    name: str
+    sizes: tuple[int, ...]
+    build: Callable[[int], tuple[Callable[[], Any], int]]
+
+
+SIZES = (10, 1_000, 100_000, 10_000_000)
+
+
+def check_case(hint: Any, make: Callable[[int], Any], elements: Callable[[int], int] = lambda size: size):
+    """Make the `build` function of a case that checks `make(size)` against `hint`."""
+    def build(size: int) -> tuple[Callable[[], Any], int]:
+        obj = make(size)
+        return (lambda: isinstance2(obj, hint)), elements(size)
+    return build
+
+
+def generator_case(hint: Any) -> Callable[[int], tuple[Callable[[], Any], int]]:
+    """Make the `build` function of a case that checks a fresh iterator over `size` ints against `hint`."""
+    def build(size: int) -> tuple[Callable[[], Any], int]:
+        items = list(range(size))
+        return (lambda: isinstance2(iter(items), hint)), size
+    return build
+
+
+def nested_case(check: Callable[[Any, Any], bool]) -> Callable[[int], tuple[Callable[[], Any], int]]:
+    """Make the `build` function of a case that checks lists nested `size` deep."""
+    def build(depth: int) -> tuple[Callable[[], Any], int]:
+        hint, obj = int, 1
+        for _ in range(depth):
+            hint, obj = list[hint], [obj]
+        return (lambda: check(obj, hint)), depth
+    return build
+
+
+def subclass_matrix_case(
+    check: Callable[[Any, Any], bool], cold: bool
+) -> Callable[[int], tuple[Callable[[], Any], int]]:
+    """Make the `build` function of a case that checks every pair of the first `size` hints of `SUBCLASS_CORPUS`."""
+    def build(size: int) -> tuple[Callable[[], Any], int]:
+        pairs = [(cls, superclass) for cls in SUBCLASS_CORPUS[:size] for superclass in SUBCLASS_CORPUS[:size]]
+
+        def run() -> None:
+            if cold:
+                issubclass2_cache_clear()
+            for cls, superclass in pairs:
+                check(cls, superclass)
+
+        return run, len(pairs)
+    return build
+
+
+WIDE_UNION = Union[bytes, bytearray, complex, float, str, list[int], dict[str, int], tuple[int, ...], None, int]
+LARGE_LITERAL = Literal[tuple(f"value_{i}" for i in range(500))]
+SUBCLASS_CORPUS = [
+    int, bool, float, str, bytes, list[int], list[bool], list[int | str], Sequence[int], Sequence[float | int],
+    Iterable[int], Iterable[Any], Collection[str], tuple[int, ...], tuple[int, str], tuple[bool, str], set[int],
+    frozenset[int], Set[int], dict[str, int], dict[str, bool], Mapping[str, int], Mapping[str, Any],
+    MutableMapping[str, int], Literal[1, 2], Literal["a"], int | str, int | None, list[dict[str, list[int]]],
+    Sequence[Mapping[str, Iterable[int]]], Event, Reading, Pairs[int], Pairs[bool], IntPairs,
+]
+
+SUITE = [
+    Case("list[int]", SIZES, check_case(list[int], lambda size: list(range(size)))),
+    Case("list[str]", SIZES, check_case(list[str], lambda size: [str(i) for i in range(size)])),
+    Case(
+        "list[int | str]", SIZES,
+        check_case(list[int | str], lambda size: [i if i % 2 else str(i) for i in range(size)]),
+    ),
+    Case("set[int]", SIZES, check_case(set[int], lambda size: set(range(size)))),
+    Case(
+        "dict[str, int]", SIZES,
+        check_case(dict[str, int], lambda size: {str(i): i for i in range(size)}, lambda size: size * 2),
+    ),
+    Case("tuple[int, ...]", SIZES, check_case(tuple[int, ...], lambda size: tuple(range(size)))),
+    Case(
+        "tuple[int | str, ...]", SIZES,
+        check_case(tuple[int | str, ...], lambda size: tuple(i if i % 2 else str(i) for i in range(size))),
+    ),
+    Case(
+        "list[tuple[int, str]]", SIZES,
+        check_case(
+            list[tuple[int, str]], lambda size: [(i, "a") for i in range(size // 2)], lambda size: size // 2 * 3
+        ),
+    ),
+    Case(
+        "list[list[int]]", SIZES,
+        check_case(list[list[int]], lambda size: [list(range(100))] * max(size // 100, 1), lambda size: max(size, 100)),
+    ),
+    Case(
+        "list[dict[str, int | str | None]]", SIZES,
+        check_case(
+            list[dict[str, int | str | None]],
+            lambda size: [{"id": i, "name": "a", "parent": None} for i in range(size // 6)], lambda size: size // 6 * 7,
+        ),
+    ),
+    Case(
+        "list[<10-arm union>]", SIZES,
+        check_case(list[WIDE_UNION], lambda size: ([None, 1, "a", 2.0, b"b", (1, 2)] * size)[:size]),
+    ),
+    Case(
+        "list[<500-value Literal>]", SIZES,
+        check_case(list[LARGE_LITERAL], lambda size: [f"value_{i % 500}" for i in range(size)]),
+    ),
+    Case(
+        "list[Event]", SIZES,
+        check_case(
+            list[Event], lambda size: [{"id": i, "name": "a", "tags": ["x"]} for i in range(size // 5)],
+            lambda size: size // 5 * 5,
+        ),
+    ),
+    Case("Iterator[int] over a generator", SIZES, generator_case(Iterator[int])),
+    Case("Iterable[int | str] over a generator", SIZES, generator_case(Iterable[int | str])),
+    Case("isinstance2: nested lists", (10, 100, 200), nested_case(isinstance2)),
+    Case("isinstance2_iterative: nested lists", (10, 100, 10_000), nested_case(isinstance2_iterative)),
+    Case("issubclass2 matrix (cold)", (8, len(SUBCLASS_CORPUS)), subclass_matrix_case(issubclass2, cold=True)),
+    Case("issubclass2 matrix (warm)", (8, len(SUBCLASS_CORPUS)), subclass_matrix_case(issubclass2, cold=False)),
+    Case(
+        "issubclass2_iterative matrix (cold)", (8, len(SUBCLASS_CORPUS)),
+        subclass_matrix_case(issubclass2_iterative, cold=True),
+    ),
+]
+
+
+def measure(func: Callable[[], Any], elements: int, repeat: int) -> dict[str, float]:
+    """Time `func` and measure the peak memory it allocates."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    # Measure memory on a separate run, as tracing allocations slows everything down
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "us_per_call": best * 1e6,
+        "ns_per_element": best / elements * 1e9,
+        "elements_per_second": elements / best,
+        "peak_bytes": peak,
+    }
+
+
+def run_suite(max_size: int, pattern: Optional[str], repeat: int) -> dict[str, dict[str, float]]:
+    """Run the benchmarks of the suite whose names contain `pattern`, at sizes up to `max_size`."""
+    results = {}
+    for case in SUITE:
+        if pattern is not None and pattern not in case.name:
+            continue
+        for size in case.sizes:
+            if size > max_size:
+                continue
+            func, elements = case.build(size)
+            name = f"{case.name} [n={size}]"
+            result = results[name] = measure(func, elements, repeat)
+            del func
+            gc.collect()
+            print(
+                f"{name:<60} {result['us_per_call']:>14.2f} us/call {result['ns_per_element']:>10.2f} ns/element"
+                f" {result['peak_bytes'] / 1024:>10.1f} KiB peak"
+            )
+    return results
+
+
+def environment() -> dict[str, str]:
+    return {"python": sys.version, "implementation": platform.python_implementation(), "machine": platform.machine()}
+
+
+def compare(results: dict[str, dict[str, float]], baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compare results against a saved baseline. Returns the names of the benchmarks that got slower (or allocate more)
+    by more than `tolerance`, a fraction.
+    """
+    if baseline.get("environment") != environment():
+        print("Warning: the baseline was saved on a different Python or machine")
+    regressions = []
+    print(f"{'benchmark':<60} {'time':>10} {'memory':>10}")
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<60} {'new':>10}")
+            continue
+        time_ratio = result["us_per_call"] / before["us_per_call"]
+        # Ignore tiny allocations, which are noise
+        memory_ratio = max(result["peak_bytes"], 4096) / max(before["peak_bytes"], 4096)
+        regressed = time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<60} {time_ratio:>9.2f}x {memory_ratio:>9.2f}x{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", action="store_true", help="run the benchmark suite instead of the micro-benchmarks")
+    parser.add_argument("--max-size", type=int, default=1_000_000, help="skip suite sizes above this (default: 10^6)")
+    parser.add_argument("-k", dest="pattern", help="only run the suite benchmarks whose names contain this")
+    parser.add_argument("--repeat", type=int, default=3, help="timing runs per benchmark; the best one is reported")
+    parser.add_argument("--baseline", default="bench_baseline.json", help="the saved baseline to compare against")
+    parser.add_argument("--save", action="store_true", help="save the suite results as the new baseline")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="the slowdown that counts as a regression (default: 0.25)"
+    )
+    args = parser.parse_args(argv)
+
+    if not args.suite:
+        for benchmark in BENCHMARKS:
+            benchmark()
+        return 0
+
+    results = run_suite(args.max_size, args.pattern, args.repeat)
+    if args.save:
+        with open(args.baseline, "w") as file:
+            json.dump({"environment": environment(), "results": results}, file, indent=2)
+        print(f"Saved the baseline to {args.baseline}")
+        return 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.baseline}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,24 +2,141 @@
 This module provides two functions - `isinstance2` and `issubclass2` - which extend the built-in `isinstance` and
 `issubclass` functions in Python to work with subscripted generics.
 """
+import array
+import codecs
+import dataclasses
+import inspect
+import json
+import mmap
+import multiprocessing
+import operator
+import os
+import random
+import re
+import sys
+import threading
+import time
 import types
 import typing
-from collections.abc import Collection, Iterable, Mapping, MutableMapping, Sequence
-from functools import partial
+import weakref
+from abc import ABCMeta, get_cache_token
+from collections import OrderedDict, deque
+from collections.abc import (
+    AsyncGenerator, AsyncIterable, AsyncIterator, Collection, Container, Generator, Iterable, Iterator, Mapping,
+    MutableMapping, Sequence
+)
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial, wraps
+from itertools import chain, count, islice, repeat, starmap
 from types import UnionType
-from typing import Any, Dict, List, Literal, Optional, Set, Tuple, TypeVar, TypeVarTuple, Union, get_args, get_origin
+from typing import (
+    Any, Callable, Dict, Hashable, List, Literal, NamedTuple, Optional, Set, Tuple, TypeVar, TypeVarTuple, Union,
+    get_args, get_origin
+)
 
 GenericAlias = types.GenericAlias | typing.GenericAlias | typing._GenericAlias | typing._SpecialGenericAlias | types.UnionType  # type: ignore
 
 T = TypeVar("T")
 Ts = TypeVarTuple("Ts")
 
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class _LRUCache:
+    """A thread-safe, size-bounded mapping that evicts the least recently used entry when full."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+
 instance_checker_registry: dict[type, callable] = {}
 
+# Compiled plans for the default registry, keyed by type hint. Cleared whenever a registry is modified.
+_plan_cache = _LRUCache(maxsize=1024)
+
+# Infos for hints checked by `isinstance2_iterative`, keyed by the id of the hint. The hint itself is kept alive in the
+# value, so that its id can't be reused. Deep hints are slow to hash, which is why they're keyed by id.
+_hint_info_cache: dict[int, tuple[Any, "_HintInfo"]] = {}
+_HINT_INFO_CACHE_MAXSIZE = 256
+
+# The maximum number of object types each compiled union remembers the candidate arms for.
+_UNION_DISPATCH_MAXSIZE = 256
+
+# Normalized `_TypeNode`s keyed by type hint, and `issubclass2` results keyed by pairs of nodes.
+_node_cache = _LRUCache(maxsize=1024)
+_subclass_cache = _LRUCache(maxsize=4096)
+# Registering a virtual subclass of an ABC changes this token, and may change the results in `_subclass_cache`
+_subclass_cache_abc_token = get_cache_token()
+
+# Per instance checker registry (keyed by its id; the registry is kept alive in the value), the key and checker that
+# each origin class resolves to, or None if there is none. See `_resolve_checker`.
+_dispatch_caches: dict[int, tuple[dict, dict[Any, Optional[tuple[Any, Callable]]]]] = {}
+_dispatch_cache_abc_token = get_cache_token()
+
+# `isinstance2` results for deeply immutable objects, keyed by the id of the object and the type hint. Disabled (None)
+# unless turned on with `enable_result_cache`. The object is kept alive in the value, so that its id can't be reused.
+_result_cache: Optional[_LRUCache] = None
+_result_cache_abc_token = get_cache_token()
+
+# How `isinstance2` checks large containers in parallel, or None (the default) if it doesn't. See
+# `enable_parallel_checks`. The flag is set while a parallel check runs, so that checks made by its workers run
+# serially.
+_parallel_checks: Optional["_ParallelChecks"] = None
+_parallel_check_running = False
+
+# The profiler that instrumented checks report to, or None (the default) if profiling is off. Plans are only
+# instrumented when they are compiled while profiling is on. See `enable_check_profiling`.
+_check_profiler: Optional["_CheckProfiler"] = None
+
 
 def register(registry, key):
     def decorator(func):
         registry[key] = func
+        _dispatch_caches.pop(id(registry), None)
+        _plan_cache.clear()
+        # Subclass checks against Literals run instance checks, which may depend on the registry
+        _subclass_cache.clear()
+        _hint_info_cache.clear()
+        if _result_cache is not None:
+            _result_cache.clear()
         return func
 
     return decorator
@@ -27,6 +144,10 @@ def register(registry, key):
 
 register_instance_checker = partial(register, instance_checker_registry)
 
+# Maps an instance checker (a value in an instance checker registry) to a function that compiles it into a
+# `CheckerPlan`. Checkers without a compiler are still usable in compiled plans; they are just called as-is.
+checker_compiler_registry: dict[callable, callable] = {}
+
 
 @register(instance_checker_registry, Union)
 @register(instance_checker_registry, UnionType)
@@ -40,7 +161,8 @@ def _is_instance_of_union(obj: Any, *args: type | GenericAlias) -> bool:
 @register(instance_checker_registry, Literal)
 def _is_instance_of_literal(obj: Any, *args: type | GenericAlias) -> bool:
     for arg in args:
-        if obj == arg:
+        # Check the type too, so that e.g. True (which equals 1) is not an instance of Literal[1]
+        if type(obj) is type(arg) and obj == arg:
             return True
     return False
 
@@ -66,7 +188,9 @@ def _is_instance_of_iterable(obj: Any, arg: Optional[type | GenericAlias], *, It
     return arg is None or all(isinstance2(item, arg) for item in obj)
 
 
-for IterableSubtype in (Iterable, Collection, Sequence, List, list, Set, set, frozenset):
+_ITERABLE_SUBTYPES = (Iterable, Collection, Sequence, List, list, Set, set, frozenset)
+
+for IterableSubtype in _ITERABLE_SUBTYPES:
     register(instance_checker_registry, IterableSubtype)(
         partial(_is_instance_of_iterable, IterableSubtype=IterableSubtype)
     )
@@ -91,19 +215,637 @@ for MappingSubtype in (Mapping, MutableMapping, Dict, dict):
     )
 
 
-def isinstance2(
-    obj: Any, cls: type | GenericAlias, instance_check_registry: Dict[type, callable] = instance_checker_registry
-) -> bool:
+@register(instance_checker_registry, Container)
+def _is_instance_of_container(obj: Any, arg: Optional[type | GenericAlias] = None) -> bool:
+    if not isinstance(obj, Container):
+        return False
+    # Containers only support `in`, so their items can only be checked if they can be iterated over
+    return arg is None or not isinstance(obj, Iterable) or all(isinstance2(item, arg) for item in obj)
+
+
+def _find_checker(origin: Any, registry: dict) -> Optional[tuple[Any, Callable]]:
     """
-    Check if an object is an instance of a subscripted superclass.
+    Find the instance checker for an origin class, in the style of `functools.singledispatch`.
 
-    Args:
-        obj: The object to check.
-        cls: The type to check against.
+    Returns the key and checker registered for the origin itself, or else for the nearest class in its MRO, or else
+    for the most specific ABC that it is a (possibly virtual) subclass of. Returns None if there is no such checker.
+    """
+    if origin in registry:
+        return origin, registry[origin]
+    if not isinstance(origin, type):
+        return None
+    for base in origin.__mro__[1:]:
+        if base in registry:
+            return base, registry[base]
 
-    Returns:
-        True if the object is an instance of the superclass, False otherwise.
+    abcs = [key for key in registry if isinstance(key, ABCMeta) and issubclass(origin, key)]
+    best = [key for key in abcs if not any(other is not key and issubclass(other, key) for other in abcs)]
+    if len(best) > 1:
+        raise TypeError(f"Ambiguous instance checkers for {origin}: it is a subclass of each of {best}")
+    return (best[0], registry[best[0]]) if best else None
+
+
+def _resolve_checker(origin: Any, registry: dict) -> Optional[tuple[Any, Callable]]:
+    """Return the key and checker for an origin class (see `_find_checker`), caching the result per registry."""
+    global _dispatch_cache_abc_token
+    token = get_cache_token()
+    if token != _dispatch_cache_abc_token:
+        # Registering a virtual subclass with an ABC can change which ABC is the most specific
+        _dispatch_caches.clear()
+        _dispatch_cache_abc_token = token
+
+    entry = _dispatch_caches.get(id(registry))
+    if entry is None or entry[0] is not registry:
+        entry = _dispatch_caches[id(registry)] = (registry, {})
+    cache = entry[1]
+    try:
+        return cache[origin]
+    except KeyError:
+        resolved = cache[origin] = _find_checker(origin, registry)
+        return resolved
+
+
+PLAN_ANY = "any"
+PLAN_TYPE = "type"
+PLAN_UNION = "union"
+PLAN_LITERAL = "literal"
+PLAN_TUPLE = "tuple"
+PLAN_VARIADIC_TUPLE = "variadic_tuple"
+PLAN_ITERABLE = "iterable"
+PLAN_MAPPING = "mapping"
+PLAN_CHECKER = "checker"
+PLAN_RECORD = "record"
+
+
+class CheckerPlan:
+    """
+    A type hint compiled into a tree of specialized checks.
+
+    Attributes:
+        hint: The type hint the plan checks against.
+        kind: The kind of check; one of the `PLAN_*` constants.
+        check: A function that takes an object and returns True if it is an instance of `hint`.
+        children: The plans for the arguments of `hint`, if any.
+        guard: A type (or tuple of types) that every object accepted by `check` is an instance of, or None if there is
+            no such type.
+    """
+
+    __slots__ = ("hint", "kind", "check", "children", "guard")
+
+    def __init__(
+        self, hint: Any, kind: str, check: Callable[[Any], bool], children: tuple["CheckerPlan", ...] = (),
+        guard: Optional[type] = None
+    ):
+        self.hint = hint
+        self.kind = kind
+        self.check = check
+        self.children = children
+        self.guard = guard
+
+    def __repr__(self) -> str:
+        return f"CheckerPlan({self.hint!r}, {self.kind!r})"
+
+
+def _always_true(obj: Any) -> bool:
+    return True
+
+
+# Containers that can be iterated more than once without side effects
+_REITERABLE_TYPES = frozenset({list, tuple, set, frozenset, type({}.keys()), type({}.values())})
+
+_INT_FORMATS = frozenset("bBhHiIlLqQnNP")
+_FLOAT_FORMATS = frozenset("efd")
+_ARRAY_ITEM_TYPES = {**dict.fromkeys("bBhHiIlLqQ", int), **dict.fromkeys("fd", float), "u": str, "w": str}
+
+
+def _array_item_type(obj: array.array) -> Optional[type]:
+    return _ARRAY_ITEM_TYPES.get(obj.typecode)
+
+
+def _memoryview_item_type(obj: memoryview) -> Optional[type]:
+    if obj.ndim != 1:
+        return None
+    fmt = obj.format.lstrip("@=<>!")
+    if fmt in _INT_FORMATS:
+        return int
+    elif fmt in _FLOAT_FORMATS:
+        return float
+    elif fmt == "?":
+        return bool
+    elif fmt == "c":
+        return bytes
+    return None
+
+
+def _ndarray_item_type(obj: Any) -> Optional[type]:
+    if obj.ndim != 1 or obj.dtype.kind == "O":
+        return None
+    # Iterating over a one-dimensional array yields scalars of the dtype's scalar type
+    return obj.dtype.type
+
+
+# Maps a buffer-backed container type to a function returning the type of all of its items (or None if unknown),
+# so that such containers can be checked without touching individual items.
+_item_type_resolvers: dict[type, Callable[[Any], Optional[type]]] = {
+    array.array: _array_item_type,
+    memoryview: _memoryview_item_type,
+}
+
+
+def _get_item_type_resolver(tp: type) -> Optional[Callable[[Any], Optional[type]]]:
+    resolver = _item_type_resolvers.get(tp)
+    if resolver is None:
+        # NumPy is optional: if an object is an ndarray, NumPy has already been imported
+        numpy = sys.modules.get("numpy")
+        if numpy is not None and tp is numpy.ndarray:
+            resolver = _item_type_resolvers[tp] = _ndarray_item_type
+    return resolver
+
+
+def _is_decided_by_type(plan: CheckerPlan) -> bool:
+    """Return True if `plan.check(obj)` is always `isinstance(obj, plan.guard)`."""
+    if plan.kind == PLAN_TYPE:
+        return type(plan.guard) in (type, ABCMeta)
+    elif plan.kind == PLAN_UNION:
+        return all(_is_decided_by_type(child) for child in plan.children)
+    return False
+
+
+def _compile_all(plan: CheckerPlan) -> Callable[[Iterable], bool]:
+    """Compile a function that returns True if every item of an iterable passes `plan`."""
+    if not _is_decided_by_type(plan):
+        check = plan.check
+        return lambda items: all(map(check, items))
+
+    guard = plan.guard
+    single_type = not isinstance(guard, tuple)
+
+    def check_items(items: Iterable) -> bool:
+        tp = type(items)
+        if tp in _REITERABLE_TYPES:
+            if single_type:
+                # Let `map` call `isinstance` directly instead of going through a Python-level closure per item
+                return all(map(isinstance, items, repeat(guard)))
+            # Check each distinct item type once. Only fall back to checking items one by one if some type fails,
+            # which is still correct for objects that override `__class__`.
+            if all(issubclass(item_type, guard) for item_type in set(map(type, items))):
+                return True
+            return all(map(isinstance, items, repeat(guard)))
+
+        resolver = _get_item_type_resolver(tp)
+        if resolver is not None:
+            item_type = resolver(items)
+            if item_type is not None:
+                return len(items) == 0 or issubclass(item_type, guard)
+
+        return all(map(isinstance, items, repeat(guard)))
+
+    return check_items
+
+
+def _guard_types(guard: type | tuple[type, ...]) -> tuple[type, ...]:
+    return guard if isinstance(guard, tuple) else (guard,)
+
+
+def _is_plain_guard(guard: type | tuple[type, ...]) -> bool:
+    """
+    Return True if instance checks against `guard` are decided by `issubclass` on the object's type.
+
+    This is only true for classes whose metaclass is exactly `type`: ABCs can gain virtual subclasses at any time, and
+    other metaclasses may override `__instancecheck__`.
+    """
+    return all(type(tp) is type for tp in _guard_types(guard))
+
+
+def _resolve_union_arms(children: tuple[CheckerPlan, ...], tp: type) -> bool | tuple[Callable[[Any], bool], ...]:
+    """
+    Work out which arms of a union can accept an object whose type (and `__class__`) is `tp`.
+
+    Returns True or False if the answer is decided by the type alone, or else the checks of the candidate arms. Arms are
+    only ruled out, or decided, by plain guards (see `_is_plain_guard`), so the result can safely be cached per type.
+    """
+    checks = []
+    for child in children:
+        if child.kind == PLAN_ANY:
+            return True
+        if child.guard is None or not _is_plain_guard(child.guard):
+            checks.append(child.check)
+        elif issubclass(tp, child.guard):
+            if child.kind == PLAN_TYPE:
+                # Instance checks on plain classes are decided by the object's type
+                return True
+            checks.append(child.check)
+    return tuple(checks) or False
+
+
+def _compile_union(cls: GenericAlias, *args: type | GenericAlias, registry: dict) -> CheckerPlan:
+    children = tuple(compile_plan(arg, registry) for arg in args)
+    all_checks = tuple(child.check for child in children)
+
+    # Maps the type of an object to the arms that may accept it, or to the answer if the type alone decides it.
+    # `_resolve_union_arms` walks the MRO (via `issubclass`), so subclasses find the arms of their bases.
+    dispatch: dict[type, bool | tuple[Callable[[Any], bool], ...]] = {}
+
+    def check(obj: Any) -> bool:
+        tp = type(obj)
+        if obj.__class__ is not tp:
+            # The object claims to be of another class (e.g. a mock), which `isinstance` honours; try every arm
+            arms = all_checks
+        else:
+            arms = dispatch.get(tp)
+            if arms is None:
+                if len(dispatch) >= _UNION_DISPATCH_MAXSIZE:
+                    dispatch.clear()
+                arms = dispatch[tp] = _resolve_union_arms(children, tp)
+            if arms is True or arms is False:
+                return arms
+        for arm_check in arms:
+            if arm_check(obj):
+                return True
+        return False
+
+    guard = None
+    if all(child.guard is not None for child in children):
+        guard = tuple(dict.fromkeys(tp for child in children for tp in _guard_types(child.guard)))
+    return CheckerPlan(cls, PLAN_UNION, check, children, guard)
+
+
+register(checker_compiler_registry, _is_instance_of_union)(_compile_union)
+
+
+def _compile_literal(cls: GenericAlias, *args: Any, registry: dict) -> CheckerPlan:
+    # Values are stored with their types, so that e.g. True (which equals 1) is not an instance of Literal[1]
+    hashable_values = set()
+    unhashable_values = []
+    for arg in args:
+        try:
+            hashable_values.add((type(arg), arg))
+        except TypeError:
+            unhashable_values.append(arg)
+    values = frozenset(hashable_values)
+
+    if not unhashable_values:
+        def check(obj: Any) -> bool:
+            try:
+                return (type(obj), obj) in values
+            except TypeError:
+                # Unhashable objects can't equal any of the (hashable) values
+                return False
+    else:
+        def check(obj: Any) -> bool:
+            try:
+                if (type(obj), obj) in values:
+                    return True
+            except TypeError:
+                pass
+            return _is_instance_of_literal(obj, *unhashable_values)
+
+    guard = tuple(dict.fromkeys(type(arg) for arg in args))
+    return CheckerPlan(cls, PLAN_LITERAL, check, (), guard)
+
+
+register(checker_compiler_registry, _is_instance_of_literal)(_compile_literal)
+
+
+def _compile_tuple(cls: GenericAlias, *args: type | GenericAlias, registry: dict) -> CheckerPlan:
+    if Ellipsis in args:
+        if len(args) != 2:
+            raise TypeError(f"Tuple with Ellipsis must have exactly two arguments; got {len(args)}")
+        item_plan = compile_plan(args[0], registry)
+        check_items = _compile_all(item_plan)
+
+        def check(obj: Any) -> bool:
+            return isinstance(obj, tuple) and check_items(obj)
+
+        return CheckerPlan(cls, PLAN_VARIADIC_TUPLE, check, (item_plan,), tuple)
+
+    children = tuple(compile_plan(arg, registry) for arg in args)
+    length = len(children)
+
+    if all(child.kind == PLAN_TYPE for child in children):
+        classes = tuple(child.hint for child in children)
+
+        def check(obj: Any) -> bool:
+            return isinstance(obj, tuple) and len(obj) == length and all(map(isinstance, obj, classes))
+    else:
+        checks = tuple(child.check for child in children)
+
+        def check(obj: Any) -> bool:
+            return isinstance(obj, tuple) and len(obj) == length and all(map(operator.call, checks, obj))
+
+    return CheckerPlan(cls, PLAN_TUPLE, check, children, tuple)
+
+
+register(checker_compiler_registry, _is_instance_of_tuple)(_compile_tuple)
+
+
+def _compile_iterable(
+    cls: GenericAlias, arg: Optional[type | GenericAlias], *, registry: dict, IterableSubtype: type
+) -> CheckerPlan:
+    guard = get_origin(IterableSubtype) or IterableSubtype
+    item_plan = None if arg is None else compile_plan(arg, registry)
+
+    if item_plan is None or item_plan.kind == PLAN_ANY:
+        # Nothing to check per item, so don't iterate (and possibly exhaust) the object at all
+        def check(obj: Any) -> bool:
+            return isinstance(obj, IterableSubtype)
+
+        return CheckerPlan(cls, PLAN_ITERABLE, check, (), guard)
+
+    check_items = _compile_all(item_plan)
+    conforms = _compile_conforms(cls)
+
+    def check(obj: Any) -> bool:
+        if type(obj) in _checked_container_types and conforms(obj):
+            return True
+        return isinstance(obj, IterableSubtype) and check_items(obj)
+
+    return CheckerPlan(cls, PLAN_ITERABLE, check, (item_plan,), guard)
+
+
+def _compile_mapping(
+    cls: GenericAlias, key_type: Optional[type | GenericAlias], value_type: Optional[type | GenericAlias], *,
+    registry: dict, MappingSubtype: type
+) -> CheckerPlan:
+    guard = get_origin(MappingSubtype) or MappingSubtype
+    if key_type is None and value_type is None:
+        def check(obj: Any) -> bool:
+            return isinstance(obj, MappingSubtype)
+
+        return CheckerPlan(cls, PLAN_MAPPING, check, (), guard)
+    if key_type is None or value_type is None:
+        raise TypeError(f"Got only one of key_type and value_type, expected both or neither")
+
+    key_plan = compile_plan(key_type, registry)
+    value_plan = compile_plan(value_type, registry)
+    check_keys = _compile_all(key_plan)
+    check_values = _compile_all(value_plan)
+    conforms = _compile_conforms(cls)
+
+    def check(obj: Any) -> bool:
+        if type(obj) in _checked_container_types and conforms(obj):
+            return True
+        return isinstance(obj, MappingSubtype) and check_keys(obj.keys()) and check_values(obj.values())
+
+    return CheckerPlan(cls, PLAN_MAPPING, check, (key_plan, value_plan), guard)
+
+
+for IterableSubtype in _ITERABLE_SUBTYPES:
+    register(checker_compiler_registry, instance_checker_registry[IterableSubtype])(
+        partial(_compile_iterable, IterableSubtype=IterableSubtype)
+    )
+
+for MappingSubtype in (Mapping, MutableMapping, Dict, dict):
+    register(checker_compiler_registry, instance_checker_registry[MappingSubtype])(
+        partial(_compile_mapping, MappingSubtype=MappingSubtype)
+    )
+
+
+def _compile_container(cls: GenericAlias, arg: Optional[type | GenericAlias] = None, *, registry: dict) -> CheckerPlan:
+    if arg is None:
+        def check(obj: Any) -> bool:
+            return isinstance(obj, Container)
+
+        return CheckerPlan(cls, PLAN_CHECKER, check, (), Container)
+
+    item_plan = compile_plan(arg, registry)
+    check_items = _compile_all(item_plan)
+
+    def check(obj: Any) -> bool:
+        return isinstance(obj, Container) and (not isinstance(obj, Iterable) or check_items(obj))
+
+    return CheckerPlan(cls, PLAN_CHECKER, check, (item_plan,), Container)
+
+
+register(checker_compiler_registry, _is_instance_of_container)(_compile_container)
+
+
+RECORD_TYPED_DICT = "typed_dict"
+RECORD_DATACLASS = "dataclass"
+RECORD_NAMED_TUPLE = "named_tuple"
+
+
+class _RecordFields:
+    """
+    The field table of a record class: a `TypedDict`, a dataclass or a `NamedTuple`.
+
+    Attributes:
+        kind: The kind of record; one of the `RECORD_*` constants.
+        names: The names of the fields, in order.
+        hints: The type hints of the fields, in the same order (`Any` for fields without one).
+        required: The names of the fields that must be present. Only `TypedDict`s have fields that may be missing.
+    """
+
+    __slots__ = ("kind", "names", "hints", "required")
+
+    def __init__(self, kind: str, names: tuple[str, ...], hints: tuple[Any, ...], required: frozenset[str]):
+        self.kind = kind
+        self.names = names
+        self.hints = hints
+        self.required = required
+
+
+# Field tables of record classes, keyed by class, or None for classes that aren't records. Cleared when it gets too
+# big, and by `clear_checker_cache`.
+_record_fields_cache: dict[type, Optional[_RecordFields]] = {}
+_RECORD_FIELDS_CACHE_MAXSIZE = 1024
+
+
+def _build_record_fields(cls: type) -> Optional[_RecordFields]:
+    if typing.is_typeddict(cls):
+        hints = typing.get_type_hints(cls)
+        return _RecordFields(RECORD_TYPED_DICT, tuple(hints), tuple(hints.values()), cls.__required_keys__)
+    if dataclasses.is_dataclass(cls):
+        hints = typing.get_type_hints(cls)
+        names = tuple(field.name for field in dataclasses.fields(cls))
+        return _RecordFields(RECORD_DATACLASS, names, tuple(hints.get(name, Any) for name in names), frozenset(names))
+    if issubclass(cls, tuple) and isinstance(getattr(cls, "_fields", None), tuple):
+        # Also covers `collections.namedtuple`, whose fields have no hints
+        hints = typing.get_type_hints(cls)
+        names = cls._fields
+        return _RecordFields(RECORD_NAMED_TUPLE, names, tuple(hints.get(name, Any) for name in names), frozenset(names))
+    return None
+
+
+def _record_fields(cls: type) -> Optional[_RecordFields]:
+    """Return the field table of a record class, or None if `cls` is not a record class."""
+    try:
+        return _record_fields_cache[cls]
+    except KeyError:
+        pass
+    fields = _build_record_fields(cls)
+    if len(_record_fields_cache) >= _RECORD_FIELDS_CACHE_MAXSIZE:
+        _record_fields_cache.clear()
+    _record_fields_cache[cls] = fields
+    return fields
+
+
+# Record classes whose plans are being compiled. Fields that refer back to one of them (directly or not) look its plan
+# up when they are checked, instead of compiling it again forever.
+_records_being_compiled: set[type] = set()
+
+_MISSING = object()
+
+
+def _compile_record(cls: type, fields: _RecordFields, registry: dict) -> CheckerPlan:
+    guard = dict if fields.kind == RECORD_TYPED_DICT else cls
+    if cls in _records_being_compiled:
+        def check(obj: Any) -> bool:
+            return compile_plan(cls, registry).check(obj)
+
+        return CheckerPlan(cls, PLAN_RECORD, check, (), guard)
+
+    _records_being_compiled.add(cls)
+    try:
+        checks = tuple(_compile_annotation(hint, registry) or _always_true for hint in fields.hints)
+    finally:
+        _records_being_compiled.discard(cls)
+    names = fields.names
+
+    if fields.kind == RECORD_TYPED_DICT:
+        required = fields.required
+        table = tuple(zip(names, checks))
+
+        def check(obj: Any) -> bool:
+            if not isinstance(obj, dict) or not obj.keys() >= required:
+                return False
+            # Keys that aren't fields are allowed, as a TypedDict with more keys is a subtype of one with fewer
+            for name, check_value in table:
+                value = obj.get(name, _MISSING)
+                if value is not _MISSING and not check_value(value):
+                    return False
+            return True
+
+    elif fields.kind == RECORD_DATACLASS:
+        def check(obj: Any) -> bool:
+            if not isinstance(obj, cls):
+                return False
+            try:
+                return all(map(operator.call, checks, map(getattr, repeat(obj), names)))
+            except AttributeError:
+                # Fields with `init=False` and no default may not be set
+                return False
+
+    else:
+        def check(obj: Any) -> bool:
+            return isinstance(obj, cls) and all(map(operator.call, checks, obj))
+
+    return CheckerPlan(cls, PLAN_RECORD, check, (), guard)
+
+
+# Per generic class, the arguments of each of its generic ancestors (including itself) in terms of its own type
+# parameters. Entries go away with their classes, and are cleared by `clear_checker_cache`.
+_generic_tables: "weakref.WeakKeyDictionary[type, dict[type, tuple]]" = weakref.WeakKeyDictionary()
+
+# The hint that each TypeVar stands for when it is checked: its bound, the union of its constraints, or Any
+_typevar_hints: dict[TypeVar, Any] = {}
+_TYPEVAR_HINTS_MAXSIZE = 1024
+
+
+def _typevar_hint(typevar: TypeVar) -> Any:
+    """Return the hint that values of a TypeVar must be instances of."""
+    try:
+        return _typevar_hints[typevar]
+    except KeyError:
+        pass
+    if typevar.__bound__ is not None:
+        hint = typevar.__bound__
+        if isinstance(hint, typing.ForwardRef):
+            try:
+                module = sys.modules[typevar.__module__]
+                hint = typing._eval_type(hint, vars(module), None)
+            except (KeyError, NameError):
+                # The bound isn't defined (yet), so it can't be checked
+                hint = Any
+    elif typevar.__constraints__:
+        hint = Union[typevar.__constraints__]
+    else:
+        hint = Any
+    if len(_typevar_hints) >= _TYPEVAR_HINTS_MAXSIZE:
+        _typevar_hints.clear()
+    # Hints derived from TypeVars must keep their identity, since dependencies are tracked by id (see `_build_nodes`)
+    _typevar_hints[typevar] = hint
+    return hint
+
+
+def _substitute(hint: Any, substitutions: dict[TypeVar, Any]) -> Any:
+    """Replace the TypeVars in a hint."""
+    if isinstance(hint, TypeVar):
+        return substitutions.get(hint, hint)
+    parameters = getattr(hint, "__parameters__", ())
+    if not parameters or not isinstance(hint, GenericAlias):
+        return hint
+    return hint[tuple(substitutions.get(parameter, parameter) for parameter in parameters)]
+
+
+def _type_parameters(cls: type, bases: tuple) -> tuple:
+    """Return the type parameters of a class, in the order they are subscripted in."""
+    parameters = cls.__dict__.get("__parameters__")
+    if parameters is not None:
+        return parameters
+    # Subclasses of subscripted builtins and ABCs, such as `class Pairs(dict[str, T])`, take the TypeVars of their bases
+    # in order of appearance, like subclasses of `Generic` do
+    found: dict[TypeVar, None] = {}
+    for base in bases:
+        for arg in get_args(base):
+            if isinstance(arg, TypeVar):
+                found[arg] = None
+            else:
+                found.update(dict.fromkeys(getattr(arg, "__parameters__", ())))
+    return tuple(found)
+
+
+def _build_generic_table(cls: type) -> dict[type, tuple]:
+    table = {}
+    bases = cls.__dict__.get("__orig_bases__", cls.__bases__)
+    parameters = _type_parameters(cls, bases)
+    if parameters:
+        table[cls] = parameters
+    for base in bases:
+        origin = get_origin(base) or base
+        if not isinstance(origin, type) or origin is typing.Generic or origin is typing.Protocol:
+            continue
+        args = get_args(base)
+        if args:
+            table.setdefault(origin, args)
+        # Translate the ancestors of the base from its parameters into ours
+        substitutions = dict(zip(_generic_table(origin).get(origin, ()), args))
+        for ancestor, ancestor_args in _generic_table(origin).items():
+            table.setdefault(ancestor, tuple(_substitute(arg, substitutions) for arg in ancestor_args))
+    return table
+
+
+def _generic_table(cls: type) -> dict[type, tuple]:
+    """
+    Return the arguments of the generic ancestors of a class in terms of its own type parameters, worked out from the
+    `__orig_bases__` of the class and its bases. For example, for `class Pairs(dict[str, T])` it is
+    `{Pairs: (T,), dict: (str, T)}`. Empty for classes that are not generic, such as the builtin collections.
     """
+    try:
+        return _generic_tables[cls]
+    except KeyError:
+        pass
+    except TypeError:
+        # Not weakly referenceable
+        return _build_generic_table(cls)
+    table = _generic_tables[cls] = _build_generic_table(cls)
+    return table
+
+
+def _ancestor_args(cls: type, args: tuple, ancestor: type) -> Optional[tuple]:
+    """
+    Translate the arguments of a subscripted generic class into the arguments of one of its ancestors, or return None
+    if the arguments of the ancestor aren't known.
+    """
+    table = _generic_table(cls)
+    ancestor_args = table.get(ancestor)
+    if ancestor_args is None:
+        return None
+    substitutions = dict(zip(table.get(cls, ()), args))
+    return tuple(_substitute(arg, substitutions) for arg in ancestor_args)
+
+
+def _compile_plan(cls: type | GenericAlias, registry: dict) -> CheckerPlan:
     if isinstance(cls, GenericAlias):
         origin_cls = get_origin(cls)
 
@@ -112,191 +854,2703 @@ def isinstance2(
 
         args = get_args(cls)
 
-        if len(args) > 0:
-            if origin_cls in instance_checker_registry:
-                return instance_checker_registry[origin_cls](obj, *args)
-            else:
-                raise TypeError(f"Did not find a checker for {origin_cls}")
+        if len(args) == 0:
+            return CheckerPlan(cls, PLAN_ANY, _always_true)
+        resolved = _resolve_checker(origin_cls, registry)
+        if resolved is None:
+            raise TypeError(f"Did not find a checker for {origin_cls}")
+
+        key, checker = resolved
+        if key is not origin_cls:
+            # The checker is registered for an ancestor, which may take different arguments
+            args = _ancestor_args(origin_cls, args, key) or args
+        compiler = checker_compiler_registry.get(checker)
+        if compiler is not None:
+            plan = compiler(cls, *args, registry=registry)
         else:
-            return True
+            def check(obj: Any) -> bool:
+                return checker(obj, *args)
+
+            plan = CheckerPlan(cls, PLAN_CHECKER, check)
+
+        if key is not origin_cls:
+            # The checker was registered for a base class of the origin, so it only checks for that base
+            base_check = plan.check
+
+            def check(obj: Any) -> bool:
+                return isinstance(obj, origin_cls) and base_check(obj)
+
+            plan = CheckerPlan(cls, plan.kind, check, plan.children, origin_cls)
+        return plan
 
     elif cls is Any:
-        return True
+        return CheckerPlan(cls, PLAN_ANY, _always_true)
+
+    elif isinstance(cls, TypeVar):
+        return compile_plan(_typevar_hint(cls), registry)
 
     elif isinstance(cls, type):
-        return isinstance(obj, cls)
+        fields = _record_fields(cls)
+        if fields is not None:
+            return _compile_record(cls, fields, registry)
+
+        def check(obj: Any) -> bool:
+            return isinstance(obj, cls)
+
+        return CheckerPlan(cls, PLAN_TYPE, check, (), cls)
 
     else:
         raise TypeError(f"Expected a type or a GenericAlias; got {cls} of type {type(cls)}")
 
 
-def issubclass2(cls: type | GenericAlias, superclass: type | GenericAlias) -> bool:  # type: ignore
+def compile_plan(
+    cls: type | GenericAlias, instance_check_registry: Dict[type, callable] = instance_checker_registry
+) -> CheckerPlan:
     """
-    Check if a class is a subclass of a subscripted superclass.
+    Compile a type hint into a `CheckerPlan`.
+
+    The hint is analysed once: origins, arguments and registry lookups are resolved up front, so checking an object
+    against the plan only does the per-object work. Plans are cached per hint and registry.
 
     Args:
-        cls: The class to check.
-        superclass: The type to check against.
+        cls: The type to compile.
+        instance_check_registry: The registry to look up instance checkers in.
 
     Returns:
-        True if the class is a subclass of the superclass, False otherwise.
+        The compiled plan.
     """
-    # NOTE: This function needs a lot of work. It's way too long.
-    # TODO: Separate out the logic into smaller functions.
-    if superclass is Any:
-        return True
-    elif isinstance(cls, GenericAlias) and get_origin(cls) in (Union, UnionType):
-        # Each argument of the union must be a subclass of the superclass
-        return all(issubclass2(arg, superclass) for arg in get_args(cls))
-    elif isinstance(cls, GenericAlias) and get_origin(cls) == Literal:
-        # Each argument of the literal must be an instance of the superclass
-        return all(isinstance2(obj, superclass) for obj in get_args(cls))
-    elif isinstance(superclass, GenericAlias) and get_origin(superclass) in (Union, UnionType):
-        # The class must be a subclass of at least one argument of the union
-        return any(issubclass2(cls, arg) for arg in get_args(superclass))
-    elif isinstance(cls, GenericAlias) and isinstance(superclass, GenericAlias):
-        # Get the origins of each superclass
-        origin_cls: type = get_origin(cls)
-        origin_superclass: type = get_origin(superclass)
+    if instance_check_registry is instance_checker_registry:
+        key = cls
+    else:
+        # Plans for other registries are keyed by the registry's id too, and keep the registry alive so that its id
+        # can't be reused
+        key = (id(instance_check_registry), cls)
+    try:
+        entry = _plan_cache.get(key)
+    except TypeError:
+        # Unhashable hints (e.g. a Literal of unhashable values) are compiled without caching
+        entry = key = None
+    if entry is not None and entry[0] is instance_check_registry:
+        return entry[1]
+    plan = _compile_plan(cls, instance_check_registry)
+    if _check_profiler is not None:
+        plan = _profile_plan(plan, instance_check_registry)
+    if key is not None:
+        _plan_cache.put(key, (instance_check_registry, plan))
+    return plan
 
-        # Get the arguments of each superclass
-        args_cls = get_args(cls)
-        args_superclass = get_args(superclass)
 
-        # Check for special cases
-        if origin_cls is None:
-            raise TypeError(f"Got no origin for {cls}")
-        if origin_superclass is None:
-            raise TypeError(f"Got no origin for {superclass}")
-        if origin_cls != tuple and issubclass(origin_cls, tuple):
-            raise NotImplementedError(f"Got subclass of tuple for {cls}")
-        if origin_superclass != tuple and issubclass(origin_superclass, tuple):
-            raise NotImplementedError(f"Got subclass of tuple for {superclass}")
-
-        if origin_cls == tuple and origin_superclass == tuple:
-            # We must be careful to handle Ellipsis. There are four cases:
-            #
-            #   1. Ellipsis in cls and not in superclass
-            #     - The cls tuple can be arbitrarily long, but the superclass tuple must have exactly two arguments.
-            #       So, cls cannot be a subclass of superclass.
-            #
-            #   2. Ellipsis not in cls and in superclass
-            #     - Each argument of cls must be a subclass of the first argument of superclass.
-            #
-            #   3. Ellipsis in both cls and superclass
-            #     - The first argument of cls must be a subclass of the first argument of superclass.
-            #
-            #   4. Ellipsis not in either cls or superclass
-            #     - The two tuples must have the same length and each argument of cls must be a subclass of the
-            #       corresponding argument of superclass.
-            #
-            if Ellipsis in args_cls:
-                if len(args_cls) != 2:
-                    raise TypeError(f"Tuple with Ellipsis must have exactly two arguments; got {len(args_cls)}")
-            if Ellipsis in args_superclass:
-                if len(args_superclass) != 2:
-                    raise TypeError(
-                        f"Tuple with Ellipsis must have exactly two arguments; got {len(args_superclass)}"
-                    )
-            if Ellipsis in args_cls and Ellipsis not in args_superclass:
-                return False
-            elif Ellipsis not in args_cls and Ellipsis in args_superclass:
-                return all(issubclass2(arg_cls, args_superclass[0]) for arg_cls in args_cls)
-            elif Ellipsis in args_cls and Ellipsis in args_superclass:
-                return issubclass2(args_cls[0], args_superclass[0])
-            elif Ellipsis not in args_cls and Ellipsis not in args_superclass:
-                return len(args_cls) == len(args_superclass) and all(
-                    issubclass2(arg_cls, arg_superclass) for arg_cls, arg_superclass in zip(args_cls, args_superclass)
-                )
+def compile_checker(
+    cls: type | GenericAlias, instance_check_registry: Dict[type, callable] = instance_checker_registry
+) -> Callable[[Any], bool]:
+    """
+    Compile a type hint into a reusable instance checker.
 
-        # If the superclass is a tuple, the origin of cls must be a subclass of the origin of superclass
-        if origin_superclass == tuple and not issubclass(origin_cls, tuple):
-            return False
+    Args:
+        cls: The type to compile.
+        instance_check_registry: The registry to look up instance checkers in.
 
-        # TODO: can this be combined with the above? Or otherwise simplified?
-        if origin_superclass != tuple and origin_cls == tuple and issubclass(origin_superclass, Iterable):
-            if Ellipsis in args_cls:
-                if len(args_cls) != 2:
-                    raise TypeError(f"Tuple with Ellipsis must have exactly two arguments; got {len(args_cls)}")
-                if args_cls[0] is Ellipsis:
-                    raise TypeError("Tuple with Ellipsis must have exactly two arguments and the first argument must not be Ellipsis")
-                if args_cls[1] is Ellipsis:
-                    return issubclass(origin_cls, origin_superclass) and issubclass2(args_cls[0], args_cls[0])
-            else:
-                return issubclass(origin_cls, origin_superclass) and all(issubclass2(arg_cls, args_superclass[0]) for arg_cls in args_cls)
-
-        # If, by this point, either class is a subclass of tuple, we cannot handle it
-        if issubclass(origin_cls, tuple):
-            raise NotImplementedError(f"Got subclass of tuple for {cls}")
-        if issubclass(origin_superclass, tuple):
-            raise NotImplementedError(f"Got subclass of tuple for {superclass}")
-
-        # Check for the mapping cases
-        if issubclass(origin_superclass, Mapping):
-            # The origin of cls must be a subclass of the origin of superclass
-            if not issubclass(origin_cls, origin_superclass):
-                return False
+    Returns:
+        A function that takes an object and returns the same result as `isinstance2(obj, cls)`.
+    """
+    return compile_plan(cls, instance_check_registry).check
 
-            # If one of the classes lacks arguments, we presume a match
-            if len(args_cls) == 0 or len(args_superclass) == 0:
-                return True
 
-            # Otherwise, both classes must have exactly two arguments
-            if len(args_cls) != 2 or len(args_superclass) != 2:
-                raise TypeError(f"Expected two arguments; got {len(args_cls)} and {len(args_superclass)}")
-
-            # The first argument of cls (the key) must be a subclass of the first argument of superclass,
-            # and likewise for the second argument (the value)
-            return issubclass2(args_cls[0], args_superclass[0]) and issubclass2(args_cls[1], args_superclass[1])
-
-        # Get the single argument of superclass
-        if len(args_superclass) != 1:
-            raise TypeError(f"Got {len(args_superclass)} arguments for {origin_superclass}; expected 1")
-        arg_superclass = args_superclass[0]
-
-        # If the origin of cls is a tuple and the origin of superclass is not a tuple, the origin of cls must be a
-        # subclass of the origin of superclass
-        if origin_cls == tuple and origin_superclass != tuple:
-            return issubclass(origin_cls, origin_superclass) and all(
-                issubclass2(arg_cls, arg_superclass) for arg_cls in args_cls
-            )
-
-        # Get the single argument of cls
-        if len(args_cls) != 1:
-            raise TypeError(f"Got {len(args_cls)} arguments for {origin_cls}, expected 1")
-        arg_cls = args_cls[0]
-
-        # Neither cls nor superclass are a tuple or union
-        if not issubclass(origin_cls, origin_superclass):
-            return False
-        # Other builtin collections
-        if origin_cls in (Iterable, Collection, Sequence, List, list, Set, set, frozenset):
-            return issubclass2(arg_cls, arg_superclass)
-        else:
-            raise NotImplementedError(f"Got unknown origin {origin_cls} for {cls}")
-    if cls == str:
-        if isinstance(superclass, type):
-            return issubclass(str, superclass)
-        elif isinstance(superclass, GenericAlias):
-            args_superclass = get_args(superclass)
-            if get_origin(superclass) == Iterable and args_superclass and not issubclass(str, args_superclass[0]):
-                return False
-            return issubclass(str, get_origin(superclass))
-        else:
-            raise NotImplementedError(f"Got unknown superclass {superclass} for {cls}")
-    elif isinstance(cls, GenericAlias) and isinstance(superclass, type):
-        # The origin of cls must be a subclass of superclass
-        return issubclass(get_origin(cls), superclass)
-    elif isinstance(cls, type) and isinstance(superclass, GenericAlias):
-        # cls must be a subclass of the origin of superclass
-        return issubclass(cls, get_origin(superclass))
-    elif isinstance(cls, type) and isinstance(superclass, type):
-        # cls must be a subclass of superclass
-        return issubclass(cls, superclass)
+def checker_cache_info() -> CacheInfo:
+    """Return hit and miss statistics for the cache of compiled checkers."""
+    return _plan_cache.info()
 
-    else:
-        # cls and superclass must be either a type or a GenericAlias
-        raise TypeError(
-            f"Expected both arguments to be either a type or a GenericAlias; got {cls} of type {type(cls)} and "
-            f"{superclass} of type {type(superclass)}"
-        )
+
+def clear_checker_cache() -> None:
+    """Clear the cache of compiled checkers, and of the instance checkers resolved for each generic class."""
+    _plan_cache.clear()
+    _dispatch_caches.clear()
+    _record_fields_cache.clear()
+    _generic_tables.clear()
+    _typevar_hints.clear()
+    # The explicit-stack engine holds on to compiled checks too
+    _hint_info_cache.clear()
+
+
+def isinstance2(
+    obj: Any, cls: type | GenericAlias, instance_check_registry: Dict[type, callable] = instance_checker_registry
+) -> bool:
+    """
+    Check if an object is an instance of a subscripted superclass.
+
+    `TypedDict`s, dataclasses and `NamedTuple`s are checked field by field against their annotations. A `TypedDict`
+    matches any dict that has its required keys and whose values for its keys match their hints. A `TypeVar` matches
+    instances of its bound, or of any of its constraints.
+
+    The instance checker for a generic class is the one registered for the class itself or, failing that, for the
+    nearest class in its MRO or the most specific ABC it is registered with, like `functools.singledispatch`.
+
+    Args:
+        obj: The object to check.
+        cls: The type to check against.
+        instance_check_registry: The registry to look up instance checkers in.
+
+    Returns:
+        True if the object is an instance of the superclass, False otherwise.
+    """
+    if isinstance(cls, GenericAlias):
+        if _parallel_checks is not None:
+            result = _check_parallel(obj, cls, instance_check_registry)
+            if result is not None:
+                return result
+        if _result_cache is not None and instance_check_registry is instance_checker_registry:
+            return _check_cached(obj, cls)
+        return compile_plan(cls, instance_check_registry).check(obj)
+
+    elif cls is Any:
+        return True
+
+    elif isinstance(cls, TypeVar):
+        return isinstance2(obj, _typevar_hint(cls), instance_check_registry)
+
+    elif isinstance(cls, type):
+        if _record_fields(cls) is not None:
+            return compile_plan(cls, instance_check_registry).check(obj)
+        return isinstance(obj, cls)
+
+    else:
+        raise TypeError(f"Expected a type or a GenericAlias; got {cls} of type {type(cls)}")
+
+
+_IMMUTABLE_SCALAR_TYPES = frozenset({int, float, complex, bool, str, bytes, type(None)})
+_IMMUTABLE_CONTAINER_TYPES = frozenset({tuple, frozenset})
+
+
+def _is_deeply_immutable(obj: Any) -> bool:
+    """
+    Return True if nothing reachable from `obj` can ever change, so `isinstance2` always gives the same result for it.
+
+    Only exact types are admitted: subclasses of tuple or str may have mutable attributes or override the methods that
+    checks rely on.
+    """
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        tp = type(obj)
+        if tp in _IMMUTABLE_CONTAINER_TYPES:
+            stack.extend(obj)
+        elif tp not in _IMMUTABLE_SCALAR_TYPES:
+            return False
+    return True
+
+
+def _check_cached(obj: Any, cls: GenericAlias) -> bool:
+    global _result_cache_abc_token
+    cache = _result_cache
+    token = get_cache_token()
+    if token != _result_cache_abc_token:
+        # Registering a virtual subclass with an ABC can change the result of checks against it
+        cache.clear()
+        _result_cache_abc_token = token
+
+    key = (id(obj), cls)
+    try:
+        entry = cache.get(key)
+    except TypeError:
+        # Unhashable hints (e.g. a Literal of unhashable values) are checked without caching
+        return compile_plan(cls).check(obj)
+    if entry is not None and entry[0] is obj:
+        return entry[1]
+
+    result = compile_plan(cls).check(obj)
+    if _is_deeply_immutable(obj):
+        cache.put(key, (obj, result))
+    return result
+
+
+def enable_result_cache(maxsize: int = 1024) -> None:
+    """
+    Turn on caching of `isinstance2` results for deeply immutable objects.
+
+    Only objects built entirely from `tuple`, `frozenset`, `int`, `float`, `complex`, `bool`, `str`, `bytes` and `None`
+    are cached, because the result for anything else could change when it is mutated. Results are keyed by the identity
+    of the object and the type hint, and the cache keeps the most recently used `maxsize` objects alive. Admitting an
+    object costs a walk over its contents, so the cache pays off for objects that are checked repeatedly, such as
+    interned configuration tuples. Results are only cached for the default instance checker registry.
+
+    Args:
+        maxsize: The maximum number of results to keep. Calling this again with the cache enabled clears it.
+    """
+    global _result_cache
+    if maxsize < 1:
+        raise ValueError(f"maxsize must be at least 1; got {maxsize}")
+    _result_cache = _LRUCache(maxsize)
+
+
+def disable_result_cache() -> None:
+    """Turn off the `isinstance2` result cache and release the objects it holds."""
+    global _result_cache
+    _result_cache = None
+
+
+def result_cache_info() -> CacheInfo:
+    """Return hit and miss statistics for the `isinstance2` result cache. All zeros if the cache is disabled."""
+    cache = _result_cache
+    return CacheInfo(0, 0, 0, 0) if cache is None else cache.info()
+
+
+def clear_result_cache() -> None:
+    """Clear the `isinstance2` result cache, if it is enabled."""
+    cache = _result_cache
+    if cache is not None:
+        cache.clear()
+
+
+_PROFILED_CONTAINER_KINDS = frozenset({PLAN_TUPLE, PLAN_VARIADIC_TUPLE, PLAN_ITERABLE, PLAN_MAPPING})
+
+
+def _hint_label(hint: Any) -> str:
+    return typing._type_repr(hint)
+
+
+class CheckStats(NamedTuple):
+    """
+    The statistics collected by the check profiler for one hint.
+
+    Attributes:
+        hint: The hint, as a string.
+        checker: The registry key of the instance checker that handled the hint, such as `collections.abc.Mapping`, or
+            None for hints that are not subscripted generics.
+        calls: How many times the hint was checked.
+        elements: How many elements were visited: the items of the containers checked, or one per call for hints that
+            are not containers.
+        time_ns: The total time spent checking the hint, including its nested checks, in nanoseconds.
+        self_time_ns: The time spent checking the hint, excluding its nested checks, in nanoseconds.
+        failures: How many of the checks failed.
+    """
+    hint: str
+    checker: Optional[str]
+    calls: int
+    elements: int
+    time_ns: int
+    self_time_ns: int
+    failures: int
+
+
+class CheckProfile:
+    """
+    A snapshot of the statistics collected by the check profiler.
+
+    Attributes:
+        stacks: The statistics per stack of nested checks, keyed by the `(hint, checker)` frames of the stack, from the
+            outermost check in.
+    """
+
+    __slots__ = ("stacks",)
+
+    def __init__(self, stacks: Optional[dict[tuple[tuple[str, Optional[str]], ...], CheckStats]] = None):
+        self.stacks = {} if stacks is None else stacks
+
+    def stats(self) -> list[CheckStats]:
+        """Return the statistics per hint and checker, summed over all stacks, slowest first."""
+        totals: dict[tuple[str, Optional[str]], list[int]] = {}
+        for frames, stats in self.stacks.items():
+            total = totals.setdefault(frames[-1], [0, 0, 0, 0, 0])
+            total[0] += stats.calls
+            total[1] += stats.elements
+            # The time of a recursive check already includes the time of its nested checks of the same hint
+            if frames[-1] not in frames[:-1]:
+                total[2] += stats.time_ns
+            total[3] += stats.self_time_ns
+            total[4] += stats.failures
+        return sorted(
+            (CheckStats(hint, checker, *total) for (hint, checker), total in totals.items()),
+            key=lambda stats: stats.time_ns, reverse=True
+        )
+
+    def collapsed_stacks(self) -> str:
+        """
+        Export the stacks in the collapsed format read by flame graph tools such as `flamegraph.pl`, `inferno` and
+        speedscope: one line per stack, with its frames separated by semicolons and its self time in microseconds.
+        """
+        lines = []
+        for frames, stats in self.stacks.items():
+            stack = ";".join(hint.replace(";", ",") for hint, _ in frames)
+            lines.append(f"{stack} {stats.self_time_ns // 1000}")
+        return "\n".join(lines)
+
+    def metrics(self) -> list[dict[str, Any]]:
+        """Export the statistics per hint and checker as JSON-serializable dicts, for a metrics exporter."""
+        return [stats._asdict() for stats in self.stats()]
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({len(self.stacks)} stacks)"
+
+
+class _ProfileNode:
+    """The counters of one stack of nested checks, and of the stacks nested in it."""
+
+    __slots__ = ("calls", "elements", "time_ns", "failures", "children")
+
+    def __init__(self):
+        self.calls = 0
+        self.elements = 0
+        self.time_ns = 0
+        self.failures = 0
+        self.children: dict[tuple[str, Optional[str]], _ProfileNode] = {}
+
+
+class _CheckProfiler:
+    """
+    Collects the statistics of instrumented checks into a tree of stacks per thread, so that counting doesn't need a
+    lock. The trees are merged when a snapshot is taken.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._roots: list[_ProfileNode] = []
+
+    def _stack(self) -> list[_ProfileNode]:
+        try:
+            return self._local.stack
+        except AttributeError:
+            root = _ProfileNode()
+            with self._lock:
+                self._roots.append(root)
+            stack = self._local.stack = [root]
+            return stack
+
+    def call(self, frame: tuple[str, Optional[str]], func: Callable[[Any], bool], obj: Any, sized: bool) -> bool:
+        """Call `func(obj)` and count it under `frame`, nested in the check that is running in this thread."""
+        stack = self._stack()
+        parent = stack[-1]
+        node = parent.children.get(frame)
+        if node is None:
+            node = parent.children[frame] = _ProfileNode()
+        elements = 1
+        if sized:
+            try:
+                elements = len(obj)
+            except TypeError:
+                pass
+        stack.append(node)
+        start = time.perf_counter_ns()
+        result = False
+        try:
+            result = func(obj)
+            return result
+        finally:
+            node.time_ns += time.perf_counter_ns() - start
+            stack.pop()
+            node.calls += 1
+            node.elements += elements
+            if not result:
+                node.failures += 1
+
+    def adopt(self, other: "_CheckProfiler") -> None:
+        """Add the statistics collected by another profiler to this one."""
+        with other._lock:
+            roots = list(other._roots)
+        with self._lock:
+            self._roots.extend(roots)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._roots.clear()
+            # Threads start new trees on their next check
+            self._local = threading.local()
+
+    def snapshot(self) -> CheckProfile:
+        with self._lock:
+            roots = list(self._roots)
+        totals: dict[tuple[tuple[str, Optional[str]], ...], list[int]] = {}
+        # Walk the trees with an explicit stack, as they are as deep as the checked hints
+        pending = [((), root) for root in roots]
+        while pending:
+            frames, node = pending.pop()
+            for frame, child in list(node.children.items()):
+                path = (*frames, frame)
+                child_time = sum(grandchild.time_ns for grandchild in list(child.children.values()))
+                total = totals.setdefault(path, [0, 0, 0, 0, 0])
+                total[0] += child.calls
+                total[1] += child.elements
+                total[2] += child.time_ns
+                total[3] += child.time_ns - child_time
+                total[4] += child.failures
+                pending.append((path, child))
+        return CheckProfile({
+            frames: CheckStats(frames[-1][0], frames[-1][1], *total) for frames, total in totals.items()
+        })
+
+
+def _profile_plan(plan: CheckerPlan, registry: dict) -> CheckerPlan:
+    """Wrap the check of a plan so that it reports to the check profiler while profiling is on."""
+    hint = plan.hint
+    checker = None
+    if isinstance(hint, GenericAlias) and get_args(hint):
+        resolved = _resolve_checker(get_origin(hint), registry)
+        if resolved is not None:
+            checker = _hint_label(resolved[0])
+    frame = (_hint_label(hint), checker)
+    sized = plan.kind in _PROFILED_CONTAINER_KINDS
+    base_check = plan.check
+
+    def check(obj: Any) -> bool:
+        profiler = _check_profiler
+        if profiler is None:
+            return base_check(obj)
+        return profiler.call(frame, base_check, obj, sized)
+
+    return CheckerPlan(hint, plan.kind, check, plan.children, plan.guard)
+
+
+def _set_check_profiler(profiler: Optional[_CheckProfiler]) -> None:
+    global _check_profiler
+    if (profiler is None) != (_check_profiler is None):
+        # Plans are instrumented when they are compiled, so recompile them
+        _plan_cache.clear()
+        _hint_info_cache.clear()
+    _check_profiler = profiler
+
+
+def enable_check_profiling() -> None:
+    """
+    Start collecting statistics about checks: the calls, elements visited, time and failures per hint and per instance
+    checker, and per stack of nested checks. Read them with `check_profile`.
+
+    Only checks that run compiled plans are counted. This covers `isinstance2` with subscripted generics and records,
+    its variants, and `issubclass2`, but not plain classes, which `isinstance2` hands straight to `isinstance`. Nor
+    does it cover items that are decided by their type alone, such as the ints of a `list[int]`. They are still counted
+    as elements of their container. Checkers compiled before profiling was turned on, such as those of `checked`
+    functions and checked containers, are not instrumented. When profiling is off, checks carry no instrumentation
+    at all.
+    """
+    if _check_profiler is None:
+        _set_check_profiler(_CheckProfiler())
+
+
+def disable_check_profiling() -> None:
+    """Stop collecting statistics about checks and discard the statistics collected so far."""
+    _set_check_profiler(None)
+
+
+def check_profile() -> CheckProfile:
+    """Return a snapshot of the statistics collected so far. Empty if profiling is off."""
+    profiler = _check_profiler
+    return CheckProfile() if profiler is None else profiler.snapshot()
+
+
+def clear_check_profile() -> None:
+    """Discard the statistics collected so far, if profiling is on."""
+    profiler = _check_profiler
+    if profiler is not None:
+        profiler.clear()
+
+
+@contextmanager
+def profile_checks() -> typing.Iterator[CheckProfile]:
+    """
+    Collect statistics about the checks run in a block. The statistics are added to the yielded `CheckProfile` when the
+    block exits, and also to those collected outside of the block if profiling was already on.
+
+    Example:
+        with profile_checks() as profile:
+            isinstance2(payload, list[dict[str, int]])
+        print(profile.collapsed_stacks())
+    """
+    outer = _check_profiler
+    profiler = _CheckProfiler()
+    profile = CheckProfile()
+    _set_check_profiler(profiler)
+    try:
+        yield profile
+    finally:
+        _set_check_profiler(outer)
+        profile.stacks.update(profiler.snapshot().stacks)
+        if outer is not None:
+            outer.adopt(profiler)
+
+
+class SampledResult(NamedTuple):
+    """
+    The result of `isinstance2_sampled`.
+
+    A False result is always exact, because it was found by checking real items. A True result is only exact if
+    `exhaustive` is True; otherwise it means no mismatch was found among the sampled items.
+
+    Attributes:
+        result: Whether the object passed the check.
+        exhaustive: True if no items were skipped, False if at least one container was sampled.
+    """
+    result: bool
+    exhaustive: bool
+
+    def __bool__(self) -> bool:
+        return self.result
+
+
+class _SampleState:
+    __slots__ = ("sample_size", "rng", "budget", "exhaustive")
+
+    def __init__(self, sample_size: int, rng: Optional[random.Random], budget: int):
+        self.sample_size = sample_size
+        self.rng = rng
+        self.budget = budget
+        self.exhaustive = True
+
+
+def _sample(items: Iterable, state: _SampleState) -> Iterable:
+    """Return up to `state.sample_size` items of an iterable, recording in `state` whether any were skipped."""
+    sample_size = state.sample_size
+    try:
+        length = len(items)
+    except TypeError:
+        # Unsized iterables (e.g. generators) can only be sampled from the front
+        head = list(islice(items, sample_size + 1))
+        if len(head) > sample_size:
+            state.exhaustive = False
+            del head[sample_size:]
+        return head
+
+    if length <= sample_size:
+        return items
+
+    state.exhaustive = False
+    if not isinstance(items, Sequence):
+        # Without random access, sampling anything but the first items would mean iterating over all of them
+        return islice(items, sample_size)
+    if state.rng is None:
+        indices = [i * length // sample_size for i in range(sample_size)]
+    else:
+        indices = sorted(state.rng.sample(range(length), sample_size))
+    return map(items.__getitem__, indices)
+
+
+def _check_sampled(plan: CheckerPlan, obj: Any, state: _SampleState) -> bool:
+    if state.budget <= 0:
+        # Out of budget: skip the check, which can only make a True result inexact
+        state.exhaustive = False
+        return True
+    state.budget -= 1
+
+    kind = plan.kind
+    if kind == PLAN_UNION:
+        return any(
+            _check_sampled(child, obj, state)
+            for child in plan.children
+            if child.guard is None or isinstance(obj, child.guard)
+        )
+    elif kind == PLAN_TUPLE:
+        return isinstance(obj, tuple) and len(obj) == len(plan.children) and all(
+            _check_sampled(child, item, state) for child, item in zip(plan.children, obj)
+        )
+    elif kind in (PLAN_VARIADIC_TUPLE, PLAN_ITERABLE) and plan.children:
+        if not isinstance(obj, plan.guard):
+            return False
+        item_plan = plan.children[0]
+        return all(_check_sampled(item_plan, item, state) for item in _sample(obj, state))
+    elif kind == PLAN_MAPPING and plan.children:
+        if not isinstance(obj, plan.guard):
+            return False
+        key_plan, value_plan = plan.children
+        return all(
+            _check_sampled(key_plan, key, state) and _check_sampled(value_plan, value, state)
+            for key, value in _sample(obj.items(), state)
+        )
+    else:
+        return plan.check(obj)
+
+
+def isinstance2_sampled(
+    obj: Any, cls: type | GenericAlias, sample_size: int = 100, seed: int | random.Random | None = None,
+    budget: int = 10_000
+) -> SampledResult:
+    """
+    Check if an object is an instance of a subscripted superclass, checking at most `sample_size` items of each
+    container and at most `budget` values in total.
+
+    The cost of the check is bounded by `budget` rather than by the size of the object: once the budget is spent, the
+    remaining values are skipped. Sequences are sampled at evenly spaced indices, or at random indices if `seed` is
+    given. Other containers (sets, mappings, iterators) are always sampled from their first items, even if `seed` is
+    given, because picking random items from them would mean iterating over all of them.
+
+    Instance checkers registered for custom classes can't be sampled inside, so they are called as-is and each
+    counts as a single value towards the budget; their own cost is not bounded.
+
+    Args:
+        obj: The object to check.
+        cls: The type to check against.
+        sample_size: The maximum number of items to check in each container.
+        seed: A seed, or a `random.Random` instance, for sampling sequences at random indices. Passing the same seed
+            gives the same samples.
+        budget: The maximum number of values (the object itself, and each item, key and value within it) to check.
+
+    Returns:
+        A `SampledResult`, which is truthy if the object passed the check, and which records whether any items were
+        skipped.
+    """
+    if sample_size < 1:
+        raise ValueError(f"sample_size must be at least 1; got {sample_size}")
+    if budget < 1:
+        raise ValueError(f"budget must be at least 1; got {budget}")
+    rng = seed if seed is None or isinstance(seed, random.Random) else random.Random(seed)
+    state = _SampleState(sample_size, rng, budget)
+    result = _check_sampled(compile_plan(cls), obj, state)
+    return SampledResult(result, state.exhaustive)
+
+
+class TypeCheckError(TypeError):
+    """Raised when a value fails a check that was asked to raise rather than return False."""
+
+
+def _item_hint(cls: type | GenericAlias, base: type) -> type | GenericAlias:
+    """Return the item type of an iterable (or async iterable) type hint, checking that it is one."""
+    origin = get_origin(cls) or cls
+    if not isinstance(origin, type) or not issubclass(origin, base):
+        raise TypeError(f"Expected a subscripted {base.__name__} or subclass; got {cls}")
+    args = get_args(cls)
+    if origin is tuple and args and not (len(args) == 2 and args[1] is Ellipsis):
+        raise TypeError(f"Expected a variadic tuple; got {cls}")
+    return args[0] if args else Any
+
+
+def _on_item_error(index: int, item: Any, item_hint: type | GenericAlias, on_error: Optional[Callable]) -> None:
+    if on_error is None:
+        raise TypeCheckError(f"Item {index} is not an instance of {item_hint}; got {type(item)}")
+    on_error(index, item)
+
+
+def _checked_items(
+    iterator: typing.Iterator, check: Callable[[Any], bool], item_hint: type | GenericAlias,
+    on_error: Optional[Callable[[int, Any], None]]
+) -> typing.Generator:
+    try:
+        for index, item in enumerate(iterator):
+            if not check(item):
+                _on_item_error(index, item, item_hint, on_error)
+            yield item
+    finally:
+        # Closing the proxy (or an error in it) closes the source too, so that e.g. file-backed generators release
+        # their resources straight away
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+
+async def _checked_async_items(
+    aiterable: typing.AsyncIterable, check: Callable[[Any], bool], item_hint: type | GenericAlias,
+    on_error: Optional[Callable[[int, Any], None]]
+) -> typing.AsyncGenerator:
+    index = 0
+    try:
+        async for item in aiterable:
+            if not check(item):
+                _on_item_error(index, item, item_hint, on_error)
+            index += 1
+            yield item
+    finally:
+        aclose = getattr(aiterable, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def checked_iter(
+    iterable: Iterable, cls: type | GenericAlias, on_error: Optional[Callable[[int, Any], None]] = None
+) -> typing.Iterator:
+    """
+    Wrap an iterable so that each item is checked as it is consumed.
+
+    Unlike `isinstance2(iterable, Iterable[...])`, this never consumes the iterable itself, and it uses constant memory,
+    so it is suitable for generators and large streams.
+
+    Args:
+        iterable: The iterable to wrap.
+        cls: An iterable type hint, such as `Iterable[tuple[str, int]]` or `Iterator[int]`, that `iterable` must be
+            an instance of.
+        on_error: A function called with the index and value of each item that fails the check. If not given, a
+            `TypeCheckError` is raised instead.
+
+    Returns:
+        An iterator over the items of `iterable`.
+    """
+    item_hint = _item_hint(cls, Iterable)
+    if not isinstance(iterable, get_origin(cls) or cls):
+        raise TypeCheckError(f"Expected an instance of {cls}; got {type(iterable)}")
+    return _checked_items(iter(iterable), compile_checker(item_hint), item_hint, on_error)
+
+
+def checked_aiter(
+    aiterable: AsyncIterable, cls: type | GenericAlias, on_error: Optional[Callable[[int, Any], None]] = None
+) -> typing.AsyncIterator:
+    """
+    Wrap an async iterable so that each item is checked as it is consumed.
+
+    This is the async counterpart of `checked_iter`.
+
+    Args:
+        aiterable: The async iterable (such as an async generator) to wrap.
+        cls: An async iterable type hint, such as `AsyncIterable[int]` or `AsyncIterator[tuple[str, int]]`, that
+            `aiterable` must be an instance of.
+        on_error: A function called with the index and value of each item that fails the check. If not given, a
+            `TypeCheckError` is raised instead.
+
+    Returns:
+        An async iterator over the items of `aiterable`.
+    """
+    item_hint = _item_hint(cls, AsyncIterable)
+    if not isinstance(aiterable, get_origin(cls) or cls):
+        raise TypeCheckError(f"Expected an instance of {cls}; got {type(aiterable)}")
+    return _checked_async_items(aiterable, compile_checker(item_hint), item_hint, on_error)
+
+
+def _gil_enabled() -> bool:
+    """Return False on free-threaded builds of CPython running without the GIL."""
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+
+def _chunks(iterable: Iterable, chunk_size: int) -> typing.Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield chunk
+
+
+def _check_chunk(cls: type | GenericAlias, registry: Optional[dict], chunk: list) -> bytearray:
+    # Runs in worker threads and processes. The default registry is passed as None, so that process workers use their
+    # own (cached) copy of it rather than unpickling a new one for every chunk.
+    check = compile_checker(cls, instance_checker_registry if registry is None else registry)
+    return bytearray(map(operator.truth, map(check, chunk)))
+
+
+def isinstance2_many(
+    objs: Iterable, cls: type | GenericAlias, instance_check_registry: Dict[type, callable] = instance_checker_registry,
+    *, failures: bool = False, executor: str | Executor | None = None, max_workers: Optional[int] = None,
+    chunk_size: int = 10_000
+) -> bytearray | list[int]:
+    """
+    Check each of many objects against the same type hint.
+
+    The hint is compiled once for the whole batch. With `executor`, the objects are split into chunks of `chunk_size`
+    which are checked concurrently; at most two chunks per worker are held in memory at a time.
+
+    Threads only run checks in parallel on free-threaded builds of CPython; with the GIL, use processes instead. Process
+    workers receive the hint, registry and objects by pickling, so all three must be picklable, and checkers registered
+    after the workers started are only seen by workers created with the `fork` start method.
+
+    Args:
+        objs: The objects to check.
+        cls: The type to check each object against.
+        instance_check_registry: The registry to look up instance checkers in.
+        failures: If True, return the indices of the objects that failed the check instead.
+        executor: None to check serially; "thread" or "process" to check on a new thread or process pool; "auto" to
+            use threads on free-threaded builds and processes otherwise; or an existing `concurrent.futures.Executor`.
+        max_workers: The number of workers of a new pool. Defaults to the number of CPUs.
+        chunk_size: The number of objects sent to a worker at a time.
+
+    Returns:
+        A `bytearray` with one byte per object: 1 if it is an instance of `cls`, 0 otherwise. Or, if `failures` is True,
+        the indices of the objects that are not.
+    """
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1; got {chunk_size}")
+
+    if executor is None:
+        check = compile_checker(cls, instance_check_registry)
+        results = bytearray(map(operator.truth, map(check, objs)))
+    else:
+        registry = None if instance_check_registry is instance_checker_registry else instance_check_registry
+        max_workers = max_workers or os.cpu_count() or 1
+        if executor == "auto":
+            executor = "thread" if not _gil_enabled() else "process"
+        if executor == "thread":
+            pool = ThreadPoolExecutor(max_workers)
+        elif executor == "process":
+            pool = ProcessPoolExecutor(max_workers)
+        elif isinstance(executor, Executor):
+            pool = executor
+        else:
+            raise ValueError(f"Expected 'thread', 'process', 'auto' or an Executor; got {executor!r}")
+
+        results = bytearray()
+        pending: deque[Future] = deque()
+        try:
+            for chunk in _chunks(objs, chunk_size):
+                pending.append(pool.submit(_check_chunk, cls, registry, chunk))
+                if len(pending) >= 2 * max_workers:
+                    results += pending.popleft().result()
+            while pending:
+                results += pending.popleft().result()
+        finally:
+            if pool is not executor:
+                pool.shutdown(cancel_futures=True)
+
+    if failures:
+        # Failures are usually rare, so find them with C-level scans rather than a Python loop over every result
+        indices = []
+        index = results.find(0)
+        while index != -1:
+            indices.append(index)
+            index = results.find(0, index + 1)
+        return indices
+    return results
+
+
+class _ParallelChecks(NamedTuple):
+    threshold: int
+    executor: str | Executor
+    max_workers: int
+
+
+# How many items a worker checks between looking out for cancellation
+_PARALLEL_BATCH_SIZE = 16_384
+# How many ranges each worker gets on average. More ranges balance the load better and cancel sooner.
+_PARALLEL_RANGES_PER_WORKER = 4
+
+# The columns, item checks and cancellation event of the parallel check being run by forked process workers. They
+# inherit it from the parent, so the checked object is shared with them rather than pickled.
+_forked_task: Optional[tuple] = None
+
+
+def _parallel_item_checks(plan: CheckerPlan) -> Optional[tuple[Callable[[Iterable], bool], ...]]:
+    """Return the checks for the items (or for the keys and values) of a container plan, or None for other plans."""
+    if plan.kind in (PLAN_ITERABLE, PLAN_VARIADIC_TUPLE) and plan.children:
+        return (_compile_all(plan.children[0]),)
+    if plan.kind == PLAN_MAPPING and plan.children:
+        return tuple(map(_compile_all, plan.children))
+    return None
+
+
+def _check_range(columns: tuple, checks: tuple, cancelled: Any, start: int, stop: int) -> bool:
+    # Each column (the items, or the keys and the values) is checked in batches, so that a failure elsewhere can stop
+    # the range early
+    for batch_start in range(start, stop, _PARALLEL_BATCH_SIZE):
+        if cancelled.is_set():
+            # Another range failed, so this result doesn't matter
+            return True
+        batch_stop = min(batch_start + _PARALLEL_BATCH_SIZE, stop)
+        for column, check in zip(columns, checks):
+            if not check(column[batch_start:batch_stop]):
+                return False
+    return True
+
+
+def _check_forked_range(start: int, stop: int) -> bool:
+    return _check_range(*_forked_task, start, stop)
+
+
+def _check_pickled_range(cls: type | GenericAlias, registry: Optional[dict], columns: tuple) -> bool:
+    # Runs in process workers that can't share memory with the parent, and so receive the slices of the columns
+    checks = _parallel_item_checks(compile_plan(cls, instance_checker_registry if registry is None else registry))
+    return all(check(column) for column, check in zip(columns, checks))
+
+
+def _check_parallel(obj: Any, cls: GenericAlias, registry: dict) -> Optional[bool]:
+    """
+    Check a large sequence or mapping against a container hint in parallel ranges. Returns None if the check should
+    run serially instead, either because the object is too small or because the hint or object can't be split.
+    """
+    global _forked_task, _parallel_check_running
+    config = _parallel_checks
+    if config is None or _parallel_check_running:
+        return None
+    try:
+        size = len(obj)
+    except TypeError:
+        return None
+    if size < config.threshold or type(obj) in _checked_container_types:
+        return None
+
+    plan = compile_plan(cls, registry)
+    checks = _parallel_item_checks(plan)
+    # Objects of the wrong type fail straight away, and the serial check says so just as well
+    if checks is None or plan.guard is None or not isinstance(obj, plan.guard):
+        return None
+    if len(checks) == 2:
+        if not isinstance(obj, Mapping):
+            return None
+        columns = (list(obj.keys()), list(obj.values()))
+    else:
+        if not isinstance(obj, Sequence):
+            return None
+        try:
+            obj[0:0]
+        except (TypeError, KeyError):
+            # Doesn't support slicing
+            return None
+        columns = (obj,)
+
+    workers = config.max_workers
+    step = max(-(-size // (workers * _PARALLEL_RANGES_PER_WORKER)), _PARALLEL_BATCH_SIZE)
+    ranges = [(start, min(start + step, size)) for start in range(0, size, step)]
+
+    executor = config.executor
+    if executor == "auto":
+        executor = "thread" if not _gil_enabled() else "process"
+    forking = executor == "process" and "fork" in multiprocessing.get_all_start_methods()
+    if executor == "thread":
+        pool = ThreadPoolExecutor(workers)
+    elif forking:
+        context = multiprocessing.get_context("fork")
+        cancelled = context.Event()
+        _forked_task = (columns, checks, cancelled)
+        pool = ProcessPoolExecutor(workers, mp_context=context)
+    elif executor == "process":
+        pool = ProcessPoolExecutor(workers)
+    else:
+        pool = executor
+    threaded = isinstance(pool, ThreadPoolExecutor)
+    if threaded:
+        cancelled = threading.Event()
+
+    def submit(start: int, stop: int) -> Future:
+        if threaded:
+            return pool.submit(_check_range, columns, checks, cancelled, start, stop)
+        elif forking:
+            return pool.submit(_check_forked_range, start, stop)
+        else:
+            chunk = tuple(column[start:stop] for column in columns)
+            default = registry is instance_checker_registry
+            return pool.submit(_check_pickled_range, cls, None if default else registry, chunk)
+
+    _parallel_check_running = True
+    result = True
+    pending: set[Future] = set()
+    try:
+        for start, stop in ranges:
+            # Keep at most two ranges per worker in flight, as pickled ones are copies
+            while len(pending) >= 2 * workers and result:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                result = all(future.result() for future in done)
+            if not result:
+                break
+            pending.add(submit(start, stop))
+        while pending and result:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            result = all(future.result() for future in done)
+    finally:
+        if threaded or forking:
+            # Stop the ranges that are still running
+            cancelled.set()
+        for future in pending:
+            future.cancel()
+        if pool is not executor:
+            pool.shutdown(cancel_futures=True)
+        _parallel_check_running = False
+        _forked_task = None
+    return result
+
+
+def enable_parallel_checks(
+    threshold: int = 1_000_000, executor: str | Executor = "auto", max_workers: Optional[int] = None
+) -> None:
+    """
+    Check large sequences and mappings in parallel.
+
+    Once enabled, `isinstance2` splits sequences and mappings with at least `threshold` items into index ranges and
+    checks the ranges concurrently, when checked against hints such as `list[...]`, `Sequence[...]`,
+    `tuple[..., ...]` and `dict[..., ...]`. As soon as a range fails, the ranges still running stop and the rest are
+    cancelled. The result is exactly the same as that of the serial check.
+
+    Threads only check in parallel on free-threaded builds of CPython. With the GIL, use process workers. Where the
+    `fork` start method is available, the workers are forked for each check and share the object with the parent
+    instead of receiving it pickled. Elsewhere, the ranges are pickled and sent to them, like `isinstance2_many` does.
+
+    Args:
+        threshold: The number of items a container must have to be checked in parallel.
+        executor: "thread" or "process" to check on a new thread or process pool for each check; "auto" to use
+            threads on free-threaded builds and processes otherwise; or an existing `concurrent.futures.Executor`, to
+            which ranges are sent pickled if it is a process pool.
+        max_workers: The number of workers of a new pool. Defaults to the number of CPUs.
+    """
+    global _parallel_checks
+    if threshold < 1:
+        raise ValueError(f"threshold must be at least 1; got {threshold}")
+    if not isinstance(executor, Executor) and executor not in ("thread", "process", "auto"):
+        raise ValueError(f"Expected 'thread', 'process', 'auto' or an Executor; got {executor!r}")
+    _parallel_checks = _ParallelChecks(threshold, executor, max_workers or os.cpu_count() or 1)
+
+
+def disable_parallel_checks() -> None:
+    """Check every container serially again."""
+    global _parallel_checks
+    _parallel_checks = None
+
+
+# Whether functions decorated with `checked` check their arguments and return values. See `set_checked_enabled`.
+_checked_enabled = True
+
+
+def set_checked_enabled(enabled: bool) -> None:
+    """
+    Turn the checks of functions decorated with `checked` on or off globally.
+
+    While checks are off, `checked` returns functions undecorated, so functions defined in the meantime carry no
+    overhead at all; functions decorated earlier pass their calls straight through.
+
+    Args:
+        enabled: Whether to check.
+    """
+    global _checked_enabled
+    _checked_enabled = enabled
+
+
+def _compile_annotation(
+    hint: Any, registry: Dict[type, callable] = instance_checker_registry
+) -> Optional[Callable[[Any], bool]]:
+    """
+    Compile the check for an annotation, falling back to checking its origin class if it can't be checked fully.
+    Returns None if there is nothing to check.
+    """
+    if hint is Any:
+        return None
+    try:
+        return compile_checker(hint, registry)
+    except (TypeError, NotImplementedError):
+        origin = get_origin(hint)
+        if isinstance(origin, type):
+            return partial(_is_instance_flipped, origin)
+        return None
+
+
+def _is_instance_flipped(cls: type, obj: Any) -> bool:
+    return isinstance(obj, cls)
+
+
+_ITERATOR_ORIGINS = frozenset({Iterable, Iterator, Generator})
+_ASYNC_ITERATOR_ORIGINS = frozenset({AsyncIterable, AsyncIterator, AsyncGenerator})
+
+
+class _CheckedSignature:
+    """The precompiled checks for the parameters and return value of a function decorated with `checked`."""
+
+    __slots__ = ("name", "positional", "num_positional", "var_positional", "keyword", "var_keyword", "result",
+                 "item", "generator_result")
+
+    def __init__(self, func: Callable):
+        signature = inspect.signature(func)
+        hints = typing.get_type_hints(func)
+        self.name = func.__qualname__
+
+        def entry(name: str, hint: Any) -> Optional[tuple[Callable[[Any], bool], str, Any]]:
+            check = _compile_annotation(hint)
+            return None if check is None else (check, name, hint)
+
+        self.positional = []
+        self.keyword = {}
+        self.var_positional = self.var_keyword = None
+        for param in signature.parameters.values():
+            checked_param = entry(param.name, hints[param.name]) if param.name in hints else None
+            if param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD):
+                self.positional.append(checked_param)
+            if param.kind in (param.POSITIONAL_OR_KEYWORD, param.KEYWORD_ONLY) and checked_param is not None:
+                self.keyword[param.name] = checked_param
+            elif param.kind == param.VAR_POSITIONAL:
+                self.var_positional = checked_param
+            elif param.kind == param.VAR_KEYWORD:
+                self.var_keyword = checked_param
+        self.num_positional = len(self.positional)
+        self.positional = tuple(self.positional)
+
+        # Generators and async generators are checked item by item as they are consumed, with the item type (and, for
+        # generators, the return type) taken from the return annotation
+        self.result = self.item = self.generator_result = None
+        return_hint = hints.get("return", Any)
+        origin, args = get_origin(return_hint), get_args(return_hint)
+        if inspect.isgeneratorfunction(func):
+            if origin in _ITERATOR_ORIGINS and args:
+                self.item = entry("yield", args[0])
+                if len(args) == 3:
+                    self.generator_result = entry("return", args[2])
+        elif inspect.isasyncgenfunction(func):
+            if origin in _ASYNC_ITERATOR_ORIGINS and args:
+                self.item = entry("yield", args[0])
+        else:
+            self.result = entry("return", return_hint)
+
+    def fail(self, what: str, value: Any, hint: Any) -> typing.NoReturn:
+        raise TypeCheckError(f"{what} of {self.name} is not an instance of {hint}; got {type(value)}")
+
+    def check_arguments(self, args: tuple, kwargs: dict) -> None:
+        for value, checked_param in zip(args, self.positional):
+            if checked_param is not None and not checked_param[0](value):
+                self.fail(f"Argument {checked_param[1]!r}", value, checked_param[2])
+        if self.var_positional is not None and len(args) > self.num_positional:
+            check, name, hint = self.var_positional
+            for value in args[self.num_positional:]:
+                if not check(value):
+                    self.fail(f"Argument *{name}", value, hint)
+        if kwargs:
+            for name, value in kwargs.items():
+                checked_param = self.keyword.get(name, self.var_keyword)
+                if checked_param is not None and not checked_param[0](value):
+                    self.fail(f"Argument {name!r}", value, checked_param[2])
+
+    def check_value(self, checked_value: tuple, value: Any) -> None:
+        if not checked_value[0](value):
+            self.fail("Return value" if checked_value[1] == "return" else "Yielded value", value, checked_value[2])
+
+
+def _checked_generator(generator: typing.Generator, signature: _CheckedSignature) -> typing.Generator:
+    """Proxy a generator, checking what it yields and returns, and forwarding `send`, `throw` and `close` to it."""
+    item, result = signature.item, signature.generator_result
+    try:
+        value = next(generator)
+        while True:
+            if item is not None:
+                signature.check_value(item, value)
+            try:
+                sent = yield value
+            except GeneratorExit:
+                raise
+            except BaseException as exc:
+                value = generator.throw(exc)
+            else:
+                value = generator.send(sent)
+    except StopIteration as stop:
+        if result is not None:
+            signature.check_value(result, stop.value)
+        return stop.value
+    finally:
+        generator.close()
+
+
+async def _checked_async_generator(
+    generator: typing.AsyncGenerator, signature: _CheckedSignature
+) -> typing.AsyncGenerator:
+    """Proxy an async generator, checking what it yields, and forwarding `asend`, `athrow` and `aclose` to it."""
+    item = signature.item
+    try:
+        value = await generator.__anext__()
+        while True:
+            if item is not None:
+                signature.check_value(item, value)
+            try:
+                sent = yield value
+            except GeneratorExit:
+                raise
+            except BaseException as exc:
+                value = await generator.athrow(exc)
+            else:
+                value = await generator.asend(sent)
+    except StopAsyncIteration:
+        return
+    finally:
+        await generator.aclose()
+
+
+def checked(func: Callable) -> Callable:
+    """
+    Decorate a function so that its arguments and return value are checked against its annotations on every call.
+
+    The signature is analysed and every annotation compiled once, when the function is decorated (or, if an
+    annotation refers to a name that isn't defined yet, on the first call), so each call only runs the compiled checks.
+    Generators and async generators are wrapped so that each value is checked as it is yielded, and coroutines are
+    checked when they are awaited. Default values of parameters are not checked. Annotations that `isinstance2` can't
+    check are checked against their origin class only, or not at all.
+
+    See `set_checked_enabled` for turning the checks off globally.
+
+    Args:
+        func: The function to decorate.
+
+    Returns:
+        The decorated function, which raises a `TypeCheckError` if an argument or return value fails its check.
+    """
+    if not _checked_enabled:
+        return func
+
+    current_signature: Optional[_CheckedSignature] = None
+
+    def get_signature() -> _CheckedSignature:
+        nonlocal current_signature
+        if current_signature is None:
+            current_signature = _CheckedSignature(func)
+        return current_signature
+
+    try:
+        get_signature()
+    except NameError:
+        # Forward references to names defined later are resolved on the first call instead
+        pass
+
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _checked_enabled:
+                return await func(*args, **kwargs)
+            signature = current_signature or get_signature()
+            signature.check_arguments(args, kwargs)
+            result = await func(*args, **kwargs)
+            if signature.result is not None:
+                signature.check_value(signature.result, result)
+            return result
+
+    elif inspect.isgeneratorfunction(func) or inspect.isasyncgenfunction(func):
+        proxy = _checked_generator if inspect.isgeneratorfunction(func) else _checked_async_generator
+
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _checked_enabled:
+                return func(*args, **kwargs)
+            signature = current_signature or get_signature()
+            signature.check_arguments(args, kwargs)
+            generator = func(*args, **kwargs)
+            if signature.item is None and signature.generator_result is None:
+                return generator
+            return proxy(generator, signature)
+
+    else:
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _checked_enabled:
+                return func(*args, **kwargs)
+            signature = current_signature or get_signature()
+            signature.check_arguments(args, kwargs)
+            result = func(*args, **kwargs)
+            if signature.result is not None:
+                signature.check_value(signature.result, result)
+            return result
+
+    return wrapper
+
+
+# Types of checked containers (see `CheckedList`). `isinstance2` accepts their instances without looking at their items
+# when they were created for the same (normalized) hint.
+_checked_container_types: set[type] = set()
+
+
+class _CheckedContainer:
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        _checked_container_types.add(cls)
+
+
+def _container_arg_plans(hint: GenericAlias, base: type, nargs: int) -> tuple[CheckerPlan, ...]:
+    """Compile the plans for the arguments of a container type hint, checking that it is one."""
+    if get_origin(hint) is not base:
+        raise TypeError(f"Expected a subscripted {base.__name__}; got {hint}")
+    args = get_args(hint)
+    if len(args) != nargs:
+        raise TypeError(f"Expected {nargs} argument(s) to {base.__name__}; got {hint}")
+    return tuple(compile_plan(arg) for arg in args)
+
+
+def _compile_conforms(cls: GenericAlias) -> Callable[[_CheckedContainer], bool]:
+    """Compile a function that returns True if a checked container was created for a hint equivalent to `cls`."""
+    node = None
+
+    def conforms(obj: _CheckedContainer) -> bool:
+        nonlocal node
+        if node is None:
+            node = _normalize(cls)
+        return obj._node is node
+
+    return conforms
+
+
+def _check_inserted(check: Callable[[Any], bool], items: Iterable, hint: Any, what: str) -> None:
+    for item in items:
+        if not check(item):
+            raise TypeCheckError(f"{what} {item!r} is not an instance of {hint}; got {type(item)}")
+
+
+class CheckedList(_CheckedContainer, list):
+    """
+    A list that checks items against a type hint as they are added, so that it is known to be an instance of that hint
+    at all times.
+
+    `isinstance2(obj, hint)` returns True in constant time for a `CheckedList` created with an equivalent `hint`. Only
+    the list's own mutations are checked: items that are themselves mutable containers should be checked containers
+    too, or else they must not be changed in place.
+
+    Args:
+        hint: A subscripted list type, such as `list[int]`.
+        iterable: The initial items.
+
+    Raises:
+        TypeCheckError: If an item is not an instance of the item type.
+    """
+
+    __slots__ = ("hint", "_node", "_check_item")
+
+    def __init__(self, hint: GenericAlias, iterable: Iterable = ()):
+        (item_plan,) = _container_arg_plans(hint, list, 1)
+        self.hint = hint
+        self._node = _normalize(hint)
+        self._check_item = item_plan.check
+        self.extend(iterable)
+
+    def _checked(self, items: Iterable) -> list:
+        items = list(items)
+        _check_inserted(self._check_item, items, get_args(self.hint)[0], "Item")
+        return items
+
+    def __setitem__(self, index: Any, value: Any) -> None:
+        if isinstance(index, slice):
+            value = self._checked(value)
+        else:
+            _check_inserted(self._check_item, (value,), get_args(self.hint)[0], "Item")
+        super().__setitem__(index, value)
+
+    def append(self, item: Any) -> None:
+        _check_inserted(self._check_item, (item,), get_args(self.hint)[0], "Item")
+        super().append(item)
+
+    def insert(self, index: int, item: Any) -> None:
+        _check_inserted(self._check_item, (item,), get_args(self.hint)[0], "Item")
+        super().insert(index, item)
+
+    def extend(self, iterable: Iterable) -> None:
+        super().extend(self._checked(iterable))
+
+    def __iadd__(self, iterable: Iterable) -> "CheckedList":
+        self.extend(iterable)
+        return self
+
+    def copy(self) -> "CheckedList":
+        return type(self)(self.hint, self)
+
+    def __reduce__(self) -> tuple:
+        return type(self), (self.hint, list(self))
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.hint!r}, {list.__repr__(self)})"
+
+
+class CheckedDict(_CheckedContainer, dict):
+    """
+    A dict that checks keys and values against a type hint as they are added, so that it is known to be an instance
+    of that hint at all times.
+
+    `isinstance2(obj, hint)` returns True in constant time for a `CheckedDict` created with an equivalent `hint`. Only
+    the dict's own mutations are checked: values that are themselves mutable containers should be checked containers
+    too, or else they must not be changed in place.
+
+    Args:
+        hint: A subscripted dict type, such as `dict[str, int]`.
+        *args: The initial items, as for `dict`.
+        **kwargs: The initial items, as for `dict`.
+
+    Raises:
+        TypeCheckError: If a key or value is not an instance of the key or value type.
+    """
+
+    __slots__ = ("hint", "_node", "_check_key", "_check_value")
+
+    def __init__(self, hint: GenericAlias, *args: Any, **kwargs: Any):
+        key_plan, value_plan = _container_arg_plans(hint, dict, 2)
+        self.hint = hint
+        self._node = _normalize(hint)
+        self._check_key = key_plan.check
+        self._check_value = value_plan.check
+        self.update(*args, **kwargs)
+
+    def _checked(self, items: dict) -> dict:
+        key_hint, value_hint = get_args(self.hint)
+        _check_inserted(self._check_key, items.keys(), key_hint, "Key")
+        _check_inserted(self._check_value, items.values(), value_hint, "Value")
+        return items
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self._checked({key: value})
+        super().__setitem__(key, value)
+
+    def setdefault(self, key: Any, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        super().update(self._checked(dict(*args, **kwargs)))
+
+    def __ior__(self, other: Any) -> "CheckedDict":
+        self.update(other)
+        return self
+
+    def copy(self) -> "CheckedDict":
+        return type(self)(self.hint, self)
+
+    def __reduce__(self) -> tuple:
+        return type(self), (self.hint, dict(self))
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.hint!r}, {dict.__repr__(self)})"
+
+
+class CheckedSet(_CheckedContainer, set):
+    """
+    A set that checks items against a type hint as they are added, so that it is known to be an instance of that hint
+    at all times.
+
+    `isinstance2(obj, hint)` returns True in constant time for a `CheckedSet` created with an equivalent `hint`.
+
+    Args:
+        hint: A subscripted set type, such as `set[str]`.
+        iterable: The initial items.
+
+    Raises:
+        TypeCheckError: If an item is not an instance of the item type.
+    """
+
+    __slots__ = ("hint", "_node", "_check_item")
+
+    def __init__(self, hint: GenericAlias, iterable: Iterable = ()):
+        (item_plan,) = _container_arg_plans(hint, set, 1)
+        self.hint = hint
+        self._node = _normalize(hint)
+        self._check_item = item_plan.check
+        self.update(iterable)
+
+    def _checked(self, items: Iterable) -> list:
+        items = list(items)
+        _check_inserted(self._check_item, items, get_args(self.hint)[0], "Item")
+        return items
+
+    def add(self, item: Any) -> None:
+        _check_inserted(self._check_item, (item,), get_args(self.hint)[0], "Item")
+        super().add(item)
+
+    def update(self, *iterables: Iterable) -> None:
+        super().update(*map(self._checked, iterables))
+
+    def symmetric_difference_update(self, iterable: Iterable) -> None:
+        super().symmetric_difference_update(self._checked(iterable))
+
+    def __ior__(self, other: Any) -> "CheckedSet":
+        if not isinstance(other, (set, frozenset)):
+            return NotImplemented
+        self.update(other)
+        return self
+
+    def __ixor__(self, other: Any) -> "CheckedSet":
+        if not isinstance(other, (set, frozenset)):
+            return NotImplemented
+        self.symmetric_difference_update(other)
+        return self
+
+    def copy(self) -> "CheckedSet":
+        return type(self)(self.hint, self)
+
+    def __reduce__(self) -> tuple:
+        return type(self), (self.hint, set(self))
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.hint!r}, {set(self)!r})"
+
+
+class CheckFailure(NamedTuple):
+    """
+    Where and why an object failed a check.
+
+    Attributes:
+        path: The path from the checked object to the offending value, such as `[3]['items'][17]`, or an empty string
+            for the object itself.
+        expected: The (sub-)hint that the value failed.
+        actual: The type of the value.
+    """
+    path: str
+    expected: Any
+    actual: type
+
+    def __str__(self) -> str:
+        return f"Value at {self.path or '<root>'} is not an instance of {self.expected}; got {self.actual}"
+
+
+class JSONResult(NamedTuple):
+    """
+    The result of `isinstance2_json`.
+
+    Attributes:
+        result: Whether the document passed the check.
+        failure: Where the first mismatch was found, or None if the document passed.
+    """
+    result: bool
+    failure: Optional[CheckFailure]
+
+    def __bool__(self) -> bool:
+        return self.result
+
+
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_JSON_NUMBER = re.compile(r"(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?")
+_JSON_NUMBER_CHARS = re.compile(r"[-+.eE0-9]*")
+# The constants accepted by `json.load`, which include the non-standard NaN and infinities
+_JSON_CONSTANTS = (
+    ("true", True), ("false", False), ("null", None), ("NaN", float("nan")), ("Infinity", float("inf")),
+    ("-Infinity", float("-inf")),
+)
+
+_JSON_START_ARRAY = 0
+_JSON_END_ARRAY = 1
+_JSON_START_OBJECT = 2
+_JSON_END_OBJECT = 3
+_JSON_KEY = 4
+_JSON_VALUE = 5
+
+
+class _JSONReader:
+    """
+    Tokenizes JSON text read chunk by chunk.
+
+    Only the text of the token being read (and whatever else is in the current chunk) is kept in memory.
+    """
+
+    __slots__ = ("chunks", "decoder", "buf", "pos", "offset", "eof")
+
+    def __init__(self, chunks: Iterable[bytes | str]):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.buf = ""
+        self.pos = 0
+        # The position in the whole text of the start of `buf`
+        self.offset = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Append the next chunk to the buffer. Returns False if the input is exhausted."""
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            text = self.decoder.decode(b"", final=True)
+        else:
+            text = chunk if isinstance(chunk, str) else self.decoder.decode(chunk)
+        # Drop what has been read already
+        self.offset += self.pos
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def error(self, message: str, pos: Optional[int] = None) -> ValueError:
+        return ValueError(f"Invalid JSON: {message} (character {self.offset + (self.pos if pos is None else pos)})")
+
+    def next_char(self) -> Optional[str]:
+        """Skip whitespace and return the next character, or None at the end of the input."""
+        while True:
+            self.pos = _JSON_WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, char: str, message: str) -> None:
+        if self.next_char() != char:
+            raise self.error(message)
+        self.pos += 1
+
+    def read_string(self) -> str:
+        while True:
+            try:
+                value, self.pos = json.decoder.scanstring(self.buf, self.pos + 1, True)
+                return value
+            except json.JSONDecodeError as exc:
+                # The string may just continue in the next chunk
+                incomplete = exc.msg.startswith("Unterminated") or exc.pos >= len(self.buf) - 6
+                if not (incomplete and self.fill()):
+                    raise self.error(exc.msg, exc.pos) from None
+
+    def read_scalar(self, char: str) -> Any:
+        if char == '"':
+            return self.read_string()
+        while True:
+            for text, value in _JSON_CONSTANTS:
+                if self.buf.startswith(text, self.pos):
+                    self.pos += len(text)
+                    return value
+            # A token that runs to the end of the buffer may continue in the next chunk
+            if (
+                _JSON_NUMBER_CHARS.match(self.buf, self.pos).end() == len(self.buf)
+                or len(self.buf) - self.pos < len("-Infinity")
+            ) and self.fill():
+                continue
+            match = _JSON_NUMBER.match(self.buf, self.pos)
+            if match is None:
+                raise self.error("Expecting value")
+            self.pos = match.end()
+            integer, fraction, exponent = match.groups()
+            if fraction or exponent:
+                return float(match.group())
+            return int(integer)
+
+    def read_key(self, char: Optional[str]) -> str:
+        if char != '"':
+            raise self.error("Expecting property name enclosed in double quotes")
+        key = self.read_string()
+        self.expect(":", "Expecting ':' delimiter")
+        return key
+
+
+def _json_events(reader: _JSONReader) -> typing.Iterator[tuple[int, Any]]:
+    """Generate the events of a JSON document: the starts and ends of containers, keys, and scalar values."""
+    # The closing characters of the containers we're in
+    stack: list[str] = []
+    char = reader.next_char()
+    while True:
+        # Read a value
+        if char == "[":
+            reader.pos += 1
+            yield _JSON_START_ARRAY, None
+            char = reader.next_char()
+            if char != "]":
+                stack.append("]")
+                continue
+            reader.pos += 1
+            yield _JSON_END_ARRAY, None
+        elif char == "{":
+            reader.pos += 1
+            yield _JSON_START_OBJECT, None
+            char = reader.next_char()
+            if char != "}":
+                stack.append("}")
+                yield _JSON_KEY, reader.read_key(char)
+                char = reader.next_char()
+                continue
+            reader.pos += 1
+            yield _JSON_END_OBJECT, None
+        elif char is None:
+            raise reader.error("Expecting value")
+        else:
+            yield _JSON_VALUE, reader.read_scalar(char)
+
+        # After a value, close containers until there's another value to read
+        while True:
+            char = reader.next_char()
+            if not stack:
+                if char is not None:
+                    raise reader.error("Extra data")
+                return
+            if char == ",":
+                reader.pos += 1
+                char = reader.next_char()
+                if stack[-1] == "}":
+                    yield _JSON_KEY, reader.read_key(char)
+                    char = reader.next_char()
+                break
+            if char != stack[-1]:
+                raise reader.error("Expecting ',' delimiter")
+            reader.pos += 1
+            yield (_JSON_END_ARRAY if stack.pop() == "]" else _JSON_END_OBJECT), None
+
+
+# How `isinstance2_json` handles a JSON array or object against a plan; see `_json_container_rule`
+_JSON_SKIP = "skip"
+_JSON_FAIL = "fail"
+_JSON_BUILD = "build"
+_JSON_STREAM = "stream"
+
+
+def _json_container_rule(plan: CheckerPlan, container: type) -> tuple:
+    """
+    Work out how to check a JSON array (if `container` is list) or object (if it is dict) against a plan, as
+    `plan.check` would check the list or dict that `json.load` returns for it.
+
+    Returns `(_JSON_SKIP,)` if it passes whatever its contents, `(_JSON_FAIL,)` if it fails whatever its contents,
+    `(_JSON_STREAM, item_or_key_plan, value_plan)` if its items (or keys and values) can be checked one by one as they
+    are read (None meaning not checked), or `(_JSON_BUILD,)` if it has to be built in memory and checked as a whole.
+    """
+    kind = plan.kind
+    if kind == PLAN_ANY:
+        return (_JSON_SKIP,)
+    elif kind == PLAN_TYPE:
+        return (_JSON_SKIP,) if issubclass(container, plan.guard) else (_JSON_FAIL,)
+    elif kind in (PLAN_TUPLE, PLAN_VARIADIC_TUPLE):
+        return (_JSON_FAIL,)
+    elif kind == PLAN_ITERABLE:
+        if not issubclass(container, plan.guard):
+            return (_JSON_FAIL,)
+        # Iterating over a dict gives its keys
+        return (_JSON_STREAM, plan.children[0], None) if plan.children else (_JSON_SKIP,)
+    elif kind == PLAN_MAPPING:
+        if container is not dict or not issubclass(dict, plan.guard):
+            return (_JSON_FAIL,)
+        return (_JSON_STREAM, *plan.children) if plan.children else (_JSON_SKIP,)
+    elif kind == PLAN_UNION:
+        rules = set()
+        for child in plan.children:
+            rule = _json_container_rule(child, container)
+            if rule[0] == _JSON_SKIP:
+                return rule
+            if rule[0] != _JSON_FAIL:
+                rules.add(rule)
+        if not rules:
+            return (_JSON_FAIL,)
+        # Several arms may accept the container, depending on its contents
+        return rules.pop() if len(rules) == 1 else (_JSON_BUILD,)
+    else:
+        # Records, literals and registered checkers check the whole value
+        return (_JSON_BUILD,)
+
+
+class _JSONFrame:
+    """A container that `isinstance2_json` is inside of."""
+
+    __slots__ = ("mode", "item_plan", "value_plan", "index", "key", "contents", "depth")
+
+    def __init__(self, mode: str, item_plan: Optional[CheckerPlan] = None, value_plan: Optional[CheckerPlan] = None):
+        self.mode = mode
+        self.item_plan = item_plan
+        self.value_plan = value_plan
+        # The index (in arrays) or key (in objects) of the current item
+        self.index = -1
+        self.key = None
+        # For frames in `_JSON_BUILD` mode: the containers being built, and the plan to check them against
+        self.contents: list = []
+        # For frames in `_JSON_SKIP` mode: how many containers deep into the skipped value we are
+        self.depth = 0
+
+
+def _json_path(stack: list[_JSONFrame]) -> str:
+    return "".join(
+        f"[{frame.index}]" if frame.key is None else f"[{frame.key!r}]"
+        for frame in stack
+        if frame.mode == _JSON_STREAM
+    )
+
+
+def _check_json_events(events: Iterable[tuple[int, Any]], plan: CheckerPlan) -> Optional[CheckFailure]:
+    """Check a stream of JSON events against a plan. Returns the first failure, or None."""
+    rules: dict[tuple[int, type], tuple] = {}
+    stack: list[_JSONFrame] = []
+
+    for event, value in events:
+        frame = stack[-1] if stack else None
+
+        if frame is not None and frame.mode == _JSON_SKIP:
+            if event == _JSON_START_ARRAY or event == _JSON_START_OBJECT:
+                frame.depth += 1
+            elif event == _JSON_END_ARRAY or event == _JSON_END_OBJECT:
+                frame.depth -= 1
+                if frame.depth == 0:
+                    stack.pop()
+            continue
+
+        if frame is not None and frame.mode == _JSON_BUILD:
+            # Build the value like `json.load` would, then check it as a whole once it's complete
+            contents = frame.contents
+            if event == _JSON_KEY:
+                frame.key = value
+                continue
+            if event == _JSON_END_ARRAY or event == _JSON_END_OBJECT:
+                value = contents.pop()
+                if contents:
+                    continue
+                stack.pop()
+                if not frame.item_plan.check(value):
+                    return CheckFailure(_json_path(stack), frame.item_plan.hint, type(value))
+                continue
+            if event == _JSON_START_ARRAY or event == _JSON_START_OBJECT:
+                container = [] if event == _JSON_START_ARRAY else {}
+            else:
+                container = None
+            parent = contents[-1]
+            if type(parent) is list:
+                parent.append(value if container is None else container)
+            else:
+                parent[frame.key] = value if container is None else container
+            if container is not None:
+                contents.append(container)
+            continue
+
+        if event == _JSON_END_ARRAY or event == _JSON_END_OBJECT:
+            stack.pop()
+            continue
+
+        # Find the plan for the next value
+        if frame is None:
+            value_plan = plan
+        elif event == _JSON_KEY:
+            frame.key = value
+            if frame.item_plan is not None and not frame.item_plan.check(value):
+                return CheckFailure(_json_path(stack), frame.item_plan.hint, str)
+            continue
+        elif frame.key is None:
+            frame.index += 1
+            value_plan = frame.item_plan
+        else:
+            value_plan = frame.value_plan
+
+        if event == _JSON_VALUE:
+            if value_plan is not None and not value_plan.check(value):
+                return CheckFailure(_json_path(stack), value_plan.hint, type(value))
+            continue
+
+        # The start of an array or object
+        container = list if event == _JSON_START_ARRAY else dict
+        if value_plan is None:
+            rule = (_JSON_SKIP,)
+        else:
+            rule = rules.get((id(value_plan), container))
+            if rule is None:
+                rule = rules[id(value_plan), container] = _json_container_rule(value_plan, container)
+        mode = rule[0]
+        if mode == _JSON_FAIL:
+            return CheckFailure(_json_path(stack), value_plan.hint, container)
+        elif mode == _JSON_SKIP:
+            new_frame = _JSONFrame(_JSON_SKIP)
+            new_frame.depth = 1
+        elif mode == _JSON_BUILD:
+            new_frame = _JSONFrame(_JSON_BUILD, value_plan)
+            new_frame.contents.append(container())
+        elif container is list:
+            new_frame = _JSONFrame(_JSON_STREAM, rule[1])
+        else:
+            new_frame = _JSONFrame(_JSON_STREAM, rule[1], rule[2])
+            new_frame.key = ""
+        stack.append(new_frame)
+
+    return None
+
+
+def _json_chunks(
+    source: str | os.PathLike | bytes | typing.BinaryIO, chunk_size: int, use_mmap: bool
+) -> typing.Iterator[bytes | str]:
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as file:
+            # Empty files can't be mapped
+            if use_mmap and os.fstat(file.fileno()).st_size:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    for start in range(0, len(mapped), chunk_size):
+                        yield mapped[start:start + chunk_size]
+            else:
+                while chunk := file.read(chunk_size):
+                    yield chunk
+    elif isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        for start in range(0, len(source), chunk_size):
+            yield source[start:start + chunk_size]
+    else:
+        while chunk := source.read(chunk_size):
+            yield chunk
+
+
+def isinstance2_json(
+    source: str | os.PathLike | bytes | typing.BinaryIO, cls: type | GenericAlias, chunk_size: int = 1 << 16,
+    use_mmap: bool = False
+) -> JSONResult:
+    """
+    Check a JSON document against a type hint without loading it into memory.
+
+    The document is read and tokenized incrementally, and the tokens are checked as they arrive, giving the same
+    result as `isinstance2(json.load(source), cls)`: arrays are checked as lists and objects as dicts. Reading stops
+    at the first mismatch. Memory use grows with the nesting depth of the document, not its size, except that a value
+    is built in memory (and then checked with `isinstance2`) if its hint can't be checked token by token: a union of
+    several container types that could all match it, a record type such as a `TypedDict`, a `Literal`, or a hint with
+    a registered instance checker. Such values are usually small parts of the document.
+
+    Args:
+        source: The path of a JSON file, a binary (or text) file object, or the document as bytes.
+        cls: The type to check against.
+        chunk_size: The number of bytes (or characters) to read at a time.
+        use_mmap: If `source` is a path, memory-map the file instead of reading it.
+
+    Returns:
+        A `JSONResult`, which is truthy if the document passed the check, and which holds the JSON path, expected hint
+        and actual type of the first mismatch if it didn't.
+
+    Raises:
+        ValueError: If the document is not valid JSON. Only the part before the first mismatch is validated.
+    """
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1; got {chunk_size}")
+    chunks = _json_chunks(source, chunk_size, use_mmap)
+    try:
+        failure = _check_json_events(_json_events(_JSONReader(chunks)), compile_plan(cls))
+    finally:
+        chunks.close()
+    return JSONResult(failure is None, failure)
+
+
+def _is_leaf_plan(plan: CheckerPlan) -> bool:
+    """Return True if a plan has no sub-hints to explain a failure with."""
+    return plan.kind in (PLAN_ANY, PLAN_TYPE, PLAN_LITERAL, PLAN_CHECKER) or (
+        not plan.children and plan.kind != PLAN_RECORD
+    )
+
+
+def _annotation_plan(hint: Any, registry: dict) -> CheckerPlan:
+    """Compile an annotation into a plan, falling back like `_compile_annotation` if it can't be checked fully."""
+    if hint is Any:
+        return CheckerPlan(hint, PLAN_ANY, _always_true)
+    try:
+        return compile_plan(hint, registry)
+    except (TypeError, NotImplementedError):
+        return CheckerPlan(hint, PLAN_CHECKER, _compile_annotation(hint, registry) or _always_true)
+
+
+# How many leaf items `isinstance2_explain` checks at a time before looking for the ones that failed
+_EXPLAIN_CHUNK_SIZE = 4096
+
+
+class _Explainer:
+    """
+    Walks an object along a compiled plan like `plan.check` does, but records where it fails instead of stopping at
+    the first mismatch.
+    """
+
+    __slots__ = ("registry", "max_failures", "failures")
+
+    def __init__(self, registry: dict, max_failures: int):
+        self.registry = registry
+        self.max_failures = max_failures
+        self.failures: list[CheckFailure] = []
+
+    def done(self) -> bool:
+        return len(self.failures) >= self.max_failures
+
+    def fail(self, path: str, plan: CheckerPlan, obj: Any) -> bool:
+        self.failures.append(CheckFailure(path, plan.hint, type(obj)))
+        return False
+
+    def explain(self, obj: Any, plan: CheckerPlan, path: str) -> bool:
+        """Return True if `obj` passes `plan`. Records failures until there are `max_failures` of them."""
+        kind = plan.kind
+        if _is_leaf_plan(plan):
+            return plan.check(obj) or self.fail(path, plan, obj)
+
+        if kind == PLAN_UNION:
+            return self.explain_union(obj, plan, path)
+
+        if kind == PLAN_RECORD:
+            return self.explain_record(obj, plan, path)
+
+        if plan.guard is not None and not isinstance(obj, plan.guard):
+            return self.fail(path, plan, obj)
+        if (
+            kind in (PLAN_ITERABLE, PLAN_MAPPING) and type(obj) in _checked_container_types
+            and obj._node is _normalize(plan.hint)
+        ):
+            return True
+
+        if kind == PLAN_TUPLE:
+            if len(obj) != len(plan.children):
+                return self.fail(path, plan, obj)
+            passed = True
+            for index, (item, item_plan) in enumerate(zip(obj, plan.children)):
+                if not self.explain(item, item_plan, f"{path}[{index}]"):
+                    passed = False
+                    if self.done():
+                        break
+            return passed
+        elif kind == PLAN_MAPPING:
+            # Keys are checked before values, like `plan.check` does. Both are reported at the path of their key.
+            key_plan, value_plan = plan.children
+            passed = self.explain_items(obj.keys(), key_plan, path, obj.keys())
+            if not passed and self.done():
+                return False
+            return self.explain_items(obj.values(), value_plan, path, obj.keys()) and passed
+        else:
+            return self.explain_items(obj, plan.children[0], path)
+
+    def explain_items(self, items: Iterable, plan: CheckerPlan, path: str, keys: Optional[Iterable] = None) -> bool:
+        """Explain the items of a container, indexed by position or by the corresponding `keys`."""
+        keys = count() if keys is None else iter(keys)
+        passed = True
+        check = plan.check
+        if not _is_leaf_plan(plan):
+            # Items that pass are only checked by `plan.check`, which stops at the first mismatch of those that don't
+            for key, item in zip(keys, items):
+                if check(item):
+                    continue
+                item_path = f"{path}[{key!r}]"
+                if self.explain(item, plan, item_path):
+                    # The check consumed the item (it's an iterator), so there's nothing left to explain
+                    self.fail(item_path, plan, item)
+                passed = False
+                if self.done():
+                    break
+            return passed
+
+        # Check leaves in chunks at the speed of `plan.check`, and only look for the ones that failed in chunks that
+        # failed
+        guard = plan.guard if _is_decided_by_type(plan) else None
+        items = iter(items)
+        while chunk := list(islice(items, _EXPLAIN_CHUNK_SIZE)):
+            chunk_keys = islice(keys, len(chunk))
+            if all(map(isinstance, chunk, repeat(guard))) if guard is not None else all(map(check, chunk)):
+                # Keep the keys in step with the items
+                deque(chunk_keys, maxlen=0)
+                continue
+            for key, item in zip(chunk_keys, chunk):
+                if not check(item):
+                    passed = self.fail(f"{path}[{key!r}]", plan, item)
+                    if self.done():
+                        return False
+        return passed
+
+    def explain_union(self, obj: Any, plan: CheckerPlan, path: str) -> bool:
+        if plan.check(obj):
+            return True
+        # If only one arm could accept an object of this type, report why it didn't, which is more precise
+        candidates = [
+            child for child in plan.children
+            if child.kind not in (PLAN_ANY, PLAN_TYPE) and child.guard is not None and isinstance(obj, child.guard)
+        ]
+        if len(candidates) == 1:
+            return self.explain(obj, candidates[0], path)
+        return self.fail(path, plan, obj)
+
+    def explain_record(self, obj: Any, plan: CheckerPlan, path: str) -> bool:
+        cls = plan.hint
+        fields = _record_fields(cls)
+        if not isinstance(obj, plan.guard):
+            return self.fail(path, plan, obj)
+        if fields.kind == RECORD_TYPED_DICT:
+            if not obj.keys() >= fields.required:
+                return self.fail(path, plan, obj)
+            values = ((name, obj.get(name, _MISSING)) for name in fields.names)
+            item_path = "{}[{!r}]"
+        elif fields.kind == RECORD_DATACLASS:
+            values = [(name, getattr(obj, name, _MISSING)) for name in fields.names]
+            item_path = "{}.{}"
+            if any(value is _MISSING for _, value in values):
+                # Fields with `init=False` and no default may not be set
+                return self.fail(path, plan, obj)
+        else:
+            values = zip(fields.names, obj)
+            item_path = "{}.{}"
+
+        passed = True
+        for (name, value), hint in zip(values, fields.hints):
+            if value is _MISSING:
+                continue
+            if not self.explain(value, _annotation_plan(hint, self.registry), item_path.format(path, name)):
+                passed = False
+                if self.done():
+                    break
+        return passed
+
+
+def isinstance2_explain(
+    obj: Any, cls: type | GenericAlias, instance_check_registry: Dict[type, callable] = instance_checker_registry,
+    max_failures: int = 1
+) -> list[CheckFailure]:
+    """
+    Explain why an object is not an instance of a type hint.
+
+    The object is walked along the same compiled plan as `isinstance2`, recording the path to each mismatching value,
+    the sub-hint it failed and its type. Values that pass are checked by the compiled checks themselves, and only the
+    containers on the way to a failure are walked item by item, so explaining a failure costs about as much as the
+    check that found it. Stops after `max_failures` failures. For a union, the failure is reported inside an arm if the
+    value could only have matched that arm, and at the union otherwise.
+
+    Args:
+        obj: The object to check.
+        cls: The type to check against.
+        instance_check_registry: The registry to look up instance checkers in.
+        max_failures: The maximum number of failures to report.
+
+    Returns:
+        The failures, in the order they were found. Empty if `isinstance2(obj, cls)` is True.
+    """
+    if max_failures < 1:
+        raise ValueError(f"max_failures must be at least 1; got {max_failures}")
+    explainer = _Explainer(instance_check_registry, max_failures)
+    explainer.explain(obj, compile_plan(cls, instance_check_registry), "")
+    return explainer.failures
+
+
+NODE_ANY = "any"
+NODE_CLASS = "class"
+NODE_UNION = "union"
+NODE_LITERAL = "literal"
+NODE_TUPLE = "tuple"
+NODE_VARIADIC_TUPLE = "variadic_tuple"
+NODE_GENERIC = "generic"
+
+_GENERIC_NODE_KINDS = (NODE_TUPLE, NODE_VARIADIC_TUPLE, NODE_GENERIC)
+
+
+class _TypeNode:
+    """
+    The normalized, interned form of a type hint used by `issubclass2`.
+
+    Structurally equal hints normalize to the same node, so nodes compare and hash by identity.
+
+    Attributes:
+        kind: The kind of node; one of the `NODE_*` constants.
+        origin: The class the node is based on (`tuple` for tuples, `Any` for `Any`), or None for unions and literals.
+        args: The child nodes (for literals, the literal values). Union arms are flattened and deduplicated, and
+            variadic tuples have their single item type as their only argument.
+        hint: A type hint that normalizes to this node.
+    """
+
+    __slots__ = ("kind", "origin", "args", "hint", "__weakref__")
+
+    def __init__(self, kind: str, origin: Optional[type], args: tuple, hint: Any):
+        self.kind = kind
+        self.origin = origin
+        self.args = args
+        self.hint = hint
+
+    def __repr__(self) -> str:
+        return f"_TypeNode({self.kind!r}, {self.hint!r})"
+
+
+# Every live node, keyed by its structure. This is what makes structurally equal hints share a node.
+_node_table: "weakref.WeakValueDictionary[tuple, _TypeNode]" = weakref.WeakValueDictionary()
+
+
+def _intern(kind: str, origin: Optional[type], args: tuple, hint: Any) -> _TypeNode:
+    key = (kind, origin, frozenset(args) if kind == NODE_UNION else args)
+    if kind == NODE_LITERAL:
+        # Literal[1] and Literal[True] are different types, even though 1 == True
+        key = (kind, origin, tuple((type(arg), arg) for arg in args))
+    try:
+        node = _node_table.get(key)
+    except TypeError:
+        # Literals of unhashable values can't be interned
+        return _TypeNode(kind, origin, args, hint)
+    if node is None:
+        node = _node_table[key] = _TypeNode(kind, origin, args, hint)
+    return node
+
+
+def _node_dependencies(hint: Any) -> tuple:
+    """Return the hints that must be normalized before `hint` can be."""
+    if isinstance(hint, TypeVar):
+        return (_typevar_hint(hint),)
+    if not isinstance(hint, GenericAlias):
+        return ()
+    origin = get_origin(hint)
+    args = get_args(hint)
+    if origin is Literal:
+        return ()
+    if origin is tuple and Ellipsis in args:
+        return args[:1]
+    return args
+
+
+def _build_node(hint: Any, normalized: Callable[[Any], _TypeNode]) -> _TypeNode:
+    """Build the node for `hint`, given a function that returns the nodes of its dependencies."""
+    if hint is Any:
+        return _intern(NODE_ANY, Any, (), hint)
+    elif hint is None:
+        return _intern(NODE_CLASS, type(None), (), type(None))
+    elif isinstance(hint, TypeVar):
+        return normalized(_typevar_hint(hint))
+    elif isinstance(hint, GenericAlias):
+        origin = get_origin(hint)
+        args = get_args(hint)
+
+        if origin is None:
+            raise TypeError(f"Got no origin for {hint}")
+
+        if origin in (Union, UnionType):
+            arms: dict[_TypeNode, None] = {}
+            for arg in args:
+                node = normalized(arg)
+                for arm in node.args if node.kind == NODE_UNION else (node,):
+                    arms[arm] = None
+            if len(arms) == 1:
+                return next(iter(arms))
+            return _intern(NODE_UNION, None, tuple(arms), hint)
+
+        if origin is Literal:
+            return _intern(NODE_LITERAL, None, args, hint)
+
+        if len(args) == 0:
+            # Bare aliases such as `typing.List` are the same as their origin
+            return _intern(NODE_CLASS, origin, (), origin)
+
+        if origin is tuple and Ellipsis in args:
+            if len(args) != 2:
+                raise TypeError(f"Tuple with Ellipsis must have exactly two arguments; got {len(args)}")
+            if args[0] is Ellipsis:
+                raise TypeError(
+                    "Tuple with Ellipsis must have exactly two arguments and the first argument must not be Ellipsis"
+                )
+            return _intern(NODE_VARIADIC_TUPLE, tuple, (normalized(args[0]),), hint)
+
+        kind = NODE_TUPLE if origin is tuple else NODE_GENERIC
+        return _intern(kind, origin, tuple(normalized(arg) for arg in args), hint)
+
+    elif isinstance(hint, type):
+        return _intern(NODE_CLASS, hint, (), hint)
+
+    else:
+        raise TypeError(f"Expected a type or a GenericAlias; got {hint} of type {type(hint)}")
+
+
+def _build_nodes(hint: Any) -> _TypeNode:
+    # Build the nodes bottom-up with an explicit stack, so that arbitrarily deep hints don't hit the recursion limit.
+    # Nodes are keyed by the id of their hint, which is kept alive by `hint` until we're done.
+    built: dict[int, _TypeNode] = {}
+    stack = [hint]
+    while stack:
+        current = stack[-1]
+        if id(current) in built:
+            stack.pop()
+            continue
+        pending = [dependency for dependency in _node_dependencies(current) if id(dependency) not in built]
+        if pending:
+            stack.extend(pending)
+            continue
+        built[id(current)] = _build_node(current, lambda dependency: built[id(dependency)])
+        stack.pop()
+    return built[id(hint)]
+
+
+def _normalize(hint: Any) -> _TypeNode:
+    """Normalize a type hint into its interned `_TypeNode`."""
+    try:
+        node = _node_cache.get(hint)
+    except TypeError:
+        # Unhashable hints are normalized without caching
+        return _build_nodes(hint)
+    if node is None:
+        node = _build_nodes(hint)
+        _node_cache.put(hint, node)
+    return node
+
+
+# An expansion is either the answer to a check, or a pair `(all_mode, subchecks)`: the answer is then
+# `all(subchecks)` if `all_mode` is True and `any(subchecks)` otherwise. Describing checks this way lets the same
+# logic run on the recursive engine and on the explicit-stack engine (see `_run_expansions`).
+_Expansion = bool | tuple[bool, Iterable]
+
+
+def _run_expansions(
+    root: Any, expand: Callable[[Any], _Expansion], on_done: Optional[Callable[[Any, bool], None]] = None
+) -> bool:
+    """
+    Evaluate a tree of checks with an explicit stack instead of recursion.
+
+    Args:
+        root: The check to evaluate.
+        expand: A function that takes a check and returns its `_Expansion`.
+        on_done: If given, called with each expanded check and its result as soon as the result is known.
+
+    Returns:
+        The result of `root`.
+    """
+    expansion = expand(root)
+    if expansion is True or expansion is False:
+        return expansion
+    stack = [(expansion[0], iter(expansion[1]), root)]
+    while True:
+        all_mode, subchecks, _ = stack[-1]
+        subcheck = next(subchecks, None)
+        if subcheck is None:
+            # No subcheck decided the answer
+            result = all_mode
+        else:
+            expansion = expand(subcheck)
+            if expansion is not True and expansion is not False:
+                stack.append((expansion[0], iter(expansion[1]), subcheck))
+                continue
+            if expansion is all_mode:
+                # A subcheck passed an `all` check or failed an `any` check; carry on with the next one
+                continue
+            result = expansion
+
+        # The check on top of the stack is finished. Pop it and pass the result up for as long as it decides the
+        # answer of its parent too.
+        while True:
+            _, _, check = stack.pop()
+            if on_done is not None:
+                on_done(check, result)
+            if not stack:
+                return result
+            if result is stack[-1][0]:
+                break
+
+
+def _is_subclass_node(cls: _TypeNode, superclass: _TypeNode) -> bool:
+    key = (cls, superclass)
+    result = _subclass_cache.get(key)
+    if result is None:
+        expansion = _expand_subclass_node(cls, superclass)
+        if expansion is True or expansion is False:
+            result = expansion
+        else:
+            all_mode, pairs = expansion
+            result = (all if all_mode else any)(starmap(_is_subclass_node, pairs))
+        _subclass_cache.put(key, result)
+    return result
+
+
+def _expand_cached_subclass_node(pair: tuple[_TypeNode, _TypeNode]) -> _Expansion:
+    result = _subclass_cache.get(pair)
+    if result is not None:
+        return result
+    expansion = _expand_subclass_node(*pair)
+    if expansion is True or expansion is False:
+        _subclass_cache.put(pair, expansion)
+    return expansion
+
+
+def _is_subclass_node_iterative(cls: _TypeNode, superclass: _TypeNode) -> bool:
+    return _run_expansions((cls, superclass), _expand_cached_subclass_node, _subclass_cache.put)
+
+
+def _expand_subclass_node(cls: _TypeNode, superclass: _TypeNode) -> _Expansion:
+    if superclass.kind == NODE_ANY or cls is superclass:
+        return True
+    elif cls.kind == NODE_UNION:
+        # Each argument of the union must be a subclass of the superclass
+        return True, zip(cls.args, repeat(superclass))
+    elif cls.kind == NODE_LITERAL:
+        # Each argument of the literal must be an instance of the superclass
+        return all(isinstance2(obj, superclass.hint) for obj in cls.args)
+    elif superclass.kind == NODE_UNION:
+        # The class must be a subclass of at least one argument of the union
+        return False, zip(repeat(cls), superclass.args)
+    elif superclass.kind == NODE_LITERAL:
+        # Only literals can be subclasses of literals
+        return False
+    elif _is_record_node(cls, RECORD_TYPED_DICT) or _is_record_node(superclass, RECORD_TYPED_DICT):
+        return _expand_subclass_typed_dict_node(cls, superclass)
+    elif superclass.kind in _GENERIC_NODE_KINDS and _is_record_node(cls, RECORD_NAMED_TUPLE):
+        # A NamedTuple is a tuple of its field types
+        hints = _record_fields(cls.origin).hints
+        return True, [(_intern(NODE_TUPLE, tuple, tuple(map(_normalize, hints)), tuple[hints]), superclass)]
+    elif (
+        superclass.kind in _GENERIC_NODE_KINDS and cls.kind in (NODE_CLASS, NODE_GENERIC) and _generic_table(cls.origin)
+    ):
+        return _expand_subclass_user_generic_node(cls, superclass)
+    elif cls.kind in _GENERIC_NODE_KINDS and superclass.kind in _GENERIC_NODE_KINDS:
+        return _expand_subclass_generic_node(cls, superclass)
+    elif cls.origin is str and superclass.kind == NODE_GENERIC and len(superclass.args) == 1:
+        # A string is a collection of strings
+        return issubclass(str, superclass.origin) and (True, [(cls, superclass.args[0])])
+    else:
+        # At least one side has no arguments, so only the classes themselves need to be compared
+        return issubclass(cls.origin, superclass.origin)
+
+
+def _is_record_node(node: _TypeNode, kind: str) -> bool:
+    if node.kind != NODE_CLASS:
+        return False
+    fields = _record_fields(node.origin)
+    return fields is not None and fields.kind == kind
+
+
+def _expand_subclass_typed_dict_node(cls: _TypeNode, superclass: _TypeNode) -> _Expansion:
+    if not _is_record_node(cls, RECORD_TYPED_DICT):
+        # Other than literals, only TypedDicts are subclasses of TypedDicts
+        return False
+    if _is_record_node(superclass, RECORD_TYPED_DICT):
+        # Every key of the superclass must be a key of cls with a compatible type, and required if it is required in
+        # the superclass. Like instances, cls may have more keys.
+        fields, super_fields = _record_fields(cls.origin), _record_fields(superclass.origin)
+        hints = dict(zip(fields.names, fields.hints))
+        if not super_fields.required <= fields.required or not hints.keys() >= set(super_fields.names):
+            return False
+        return True, [
+            (_normalize(hints[name]), _normalize(hint)) for name, hint in zip(super_fields.names, super_fields.hints)
+        ]
+    if superclass.kind == NODE_GENERIC:
+        # Keys other than the fields may have any type, and so may their values
+        return issubclass(dict, superclass.origin) and all(
+            arg.kind == NODE_ANY or arg.origin is object for arg in superclass.args
+        )
+    return superclass.kind == NODE_CLASS and issubclass(dict, superclass.origin)
+
+
+def _expand_subclass_user_generic_node(cls: _TypeNode, superclass: _TypeNode) -> _Expansion:
+    origin_cls = cls.origin
+    origin_superclass = superclass.origin
+    if not issubclass(origin_cls, origin_superclass):
+        return False
+    if cls.kind == NODE_GENERIC:
+        args = tuple(arg.hint for arg in cls.args)
+    else:
+        # A bare generic class has its own (unbound) parameters as arguments
+        args = _generic_table(origin_cls).get(origin_cls, ())
+
+    if _generic_table(origin_superclass):
+        # Another user generic class: compare the arguments it is given by cls with its arguments
+        ancestor_args = _ancestor_args(origin_cls, args, origin_superclass)
+        if ancestor_args is None or len(ancestor_args) != len(superclass.args):
+            return False
+        return True, zip(map(_normalize, ancestor_args), superclass.args)
+
+    # A builtin collection or an ABC: compare the nearest ancestor of cls that is one of those, as a subscripted hint
+    for ancestor in _generic_table(origin_cls):
+        if not _generic_table(ancestor) and issubclass(ancestor, origin_superclass):
+            ancestor_args = _ancestor_args(origin_cls, args, ancestor)
+            return True, [(_normalize(ancestor[ancestor_args]), superclass)]
+
+    # The arguments cls gives the superclass are unknown, so they could be anything
+    return all(arg.kind == NODE_ANY or arg.origin is object for arg in superclass.args)
+
+
+def _expand_subclass_generic_node(cls: _TypeNode, superclass: _TypeNode) -> _Expansion:
+    origin_cls = cls.origin
+    origin_superclass = superclass.origin
+
+    if origin_cls is not tuple and issubclass(origin_cls, tuple):
+        raise NotImplementedError(f"Got subclass of tuple for {cls.hint}")
+    if origin_superclass is not tuple and issubclass(origin_superclass, tuple):
+        raise NotImplementedError(f"Got subclass of tuple for {superclass.hint}")
+
+    if origin_cls is tuple and origin_superclass is tuple:
+        # Variadic tuples are explicit in the node kind, so there are four cases:
+        #
+        #   1. cls is variadic and superclass is not
+        #     - The cls tuple can be arbitrarily long, but the superclass tuple has a fixed length. So, cls cannot be
+        #       a subclass of superclass.
+        #
+        #   2. cls is not variadic and superclass is
+        #     - Each argument of cls must be a subclass of the item type of superclass.
+        #
+        #   3. Both are variadic
+        #     - The item type of cls must be a subclass of the item type of superclass.
+        #
+        #   4. Neither is variadic
+        #     - The two tuples must have the same length and each argument of cls must be a subclass of the
+        #       corresponding argument of superclass.
+        #
+        if cls.kind == NODE_VARIADIC_TUPLE:
+            return superclass.kind == NODE_VARIADIC_TUPLE and (True, [(cls.args[0], superclass.args[0])])
+        elif superclass.kind == NODE_VARIADIC_TUPLE:
+            return True, zip(cls.args, repeat(superclass.args[0]))
+        else:
+            return len(cls.args) == len(superclass.args) and (True, zip(cls.args, superclass.args))
+
+    # If the superclass is a tuple, the origin of cls must be a subclass of the origin of superclass
+    if origin_superclass is tuple:
+        return False
+
+    if origin_cls is tuple:
+        # Every item of the tuple must be a subclass of the item type of the superclass
+        if not issubclass(tuple, origin_superclass):
+            return False
+        if len(superclass.args) != 1:
+            raise TypeError(f"Got {len(superclass.args)} arguments for {origin_superclass}; expected 1")
+        return True, zip(cls.args, repeat(superclass.args[0]))
+
+    # The origin of cls must be a subclass of the origin of superclass
+    if not issubclass(origin_cls, origin_superclass):
+        return False
+
+    # Check for the mapping cases
+    if issubclass(origin_superclass, Mapping):
+        # Both classes must have exactly two arguments
+        if len(cls.args) != 2 or len(superclass.args) != 2:
+            raise TypeError(f"Expected two arguments; got {len(cls.args)} and {len(superclass.args)}")
+
+        # The first argument of cls (the key) must be a subclass of the first argument of superclass,
+        # and likewise for the second argument (the value)
+        return True, zip(cls.args, superclass.args)
+
+    if len(superclass.args) != 1:
+        raise TypeError(f"Got {len(superclass.args)} arguments for {origin_superclass}; expected 1")
+
+    # Mappings are collections of their keys
+    if issubclass(origin_cls, Mapping) and len(cls.args) == 2:
+        return True, [(cls.args[0], superclass.args[0])]
+
+    if len(cls.args) != 1:
+        raise TypeError(f"Got {len(cls.args)} arguments for {origin_cls}, expected 1")
+
+    # Other builtin collections
+    if origin_cls in _ITERABLE_SUBTYPES:
+        return True, [(cls.args[0], superclass.args[0])]
+    else:
+        raise NotImplementedError(f"Got unknown origin {origin_cls} for {cls.hint}")
+
+
+# Hints deeper than this are checked by the explicit-stack engine level by level; shallower ones are compiled.
+_MAX_COMPILED_DEPTH = 64
+
+
+class _HintInfo:
+    """
+    How `isinstance2_iterative` checks against a hint.
+
+    Attributes:
+        kind: The kind of check; one of the `PLAN_*` constants. Only used if `check` is None.
+        guard: A type that objects must be an instance of for containers, or None.
+        children: The infos of the arguments of the hint.
+        check: A compiled check for the whole hint, if it is shallow enough to compile, otherwise None.
+        depth: The nesting depth of the hint.
+    """
+
+    __slots__ = ("kind", "guard", "children", "check", "depth")
+
+    def __init__(self, kind: str, guard: Optional[type], children: tuple["_HintInfo", ...], depth: int):
+        self.kind = kind
+        self.guard = guard
+        self.children = children
+        self.check = None
+        self.depth = depth
+
+
+def _classify_hint(hint: Any) -> tuple[str, Optional[type], tuple]:
+    """Return the kind, guard and argument hints of a hint that the explicit-stack engine can expand."""
+    if not isinstance(hint, GenericAlias) or not get_args(hint):
+        return PLAN_CHECKER, None, ()
+    args = get_args(hint)
+    origin = get_origin(hint)
+    resolved = _resolve_checker(origin, instance_checker_registry)
+    if resolved is None:
+        return PLAN_CHECKER, None, ()
+    key, checker = resolved
+    if key is not origin:
+        # Checked with the plan compiled for the whole hint, which also checks for the origin itself
+        return PLAN_CHECKER, None, ()
+    if checker is _is_instance_of_union:
+        return PLAN_UNION, None, args
+    elif checker is _is_instance_of_tuple:
+        if Ellipsis in args:
+            if len(args) != 2:
+                raise TypeError(f"Tuple with Ellipsis must have exactly two arguments; got {len(args)}")
+            return PLAN_VARIADIC_TUPLE, tuple, args[:1]
+        return PLAN_TUPLE, tuple, args
+    elif isinstance(checker, partial) and checker.func is _is_instance_of_iterable and args[0] is not None:
+        return PLAN_ITERABLE, checker.keywords["IterableSubtype"], args
+    elif isinstance(checker, partial) and checker.func is _is_instance_of_mapping and None not in args:
+        return PLAN_MAPPING, checker.keywords["MappingSubtype"], args
+    else:
+        return PLAN_CHECKER, None, ()
+
+
+def _hint_info(hint: Any) -> _HintInfo:
+    entry = _hint_info_cache.get(id(hint))
+    if entry is not None and entry[0] is hint:
+        return entry[1]
+
+    # Build the infos bottom-up with an explicit stack, keyed by the ids of their hints (which `hint` keeps alive)
+    built: dict[int, _HintInfo] = {}
+    stack = [hint]
+    while stack:
+        current = stack[-1]
+        if id(current) in built:
+            stack.pop()
+            continue
+        kind, guard, args = _classify_hint(current)
+        pending = [arg for arg in args if id(arg) not in built]
+        if pending:
+            stack.extend(pending)
+            continue
+        children = tuple(built[id(arg)] for arg in args)
+        info = _HintInfo(kind, guard, children, 1 + max((child.depth for child in children), default=0))
+        if info.depth <= _MAX_COMPILED_DEPTH:
+            info.check = compile_plan(current).check
+        built[id(current)] = info
+        stack.pop()
+
+    if len(_hint_info_cache) >= _HINT_INFO_CACHE_MAXSIZE:
+        _hint_info_cache.clear()
+    _hint_info_cache[id(hint)] = (hint, built[id(hint)])
+    return built[id(hint)]
+
+
+def _expand_instance(task: tuple[Any, _HintInfo]) -> _Expansion:
+    obj, info = task
+    if info.check is not None:
+        return info.check(obj)
+    kind = info.kind
+    if kind == PLAN_UNION:
+        return False, zip(repeat(obj), info.children)
+    elif kind == PLAN_TUPLE:
+        return isinstance(obj, tuple) and len(obj) == len(info.children) and (True, zip(obj, info.children))
+    elif kind in (PLAN_VARIADIC_TUPLE, PLAN_ITERABLE):
+        return isinstance(obj, info.guard) and (True, zip(obj, repeat(info.children[0])))
+    else:
+        key_info, value_info = info.children
+        return isinstance(obj, info.guard) and (
+            True, chain.from_iterable(((key, key_info), (value, value_info)) for key, value in obj.items())
+        )
+
+
+def isinstance2_iterative(obj: Any, cls: type | GenericAlias) -> bool:
+    """
+    Check if an object is an instance of a subscripted superclass, without recursing through Python calls.
+
+    This gives the same results as `isinstance2`, but walks deeply nested hints and objects with an explicit stack, so
+    it works at any depth. Hints (and parts of hints) that are shallow enough are still checked with compiled plans.
+
+    Args:
+        obj: The object to check.
+        cls: The type to check against.
+
+    Returns:
+        True if the object is an instance of the superclass, False otherwise.
+    """
+    return _run_expansions((obj, _hint_info(cls)), _expand_instance)
+
+
+def _check_subclass_cache_abc_token() -> None:
+    """Clear the `issubclass2` result cache if a virtual subclass was registered with any ABC since it was filled."""
+    global _subclass_cache_abc_token
+    token = get_cache_token()
+    if token != _subclass_cache_abc_token:
+        _subclass_cache.clear()
+        _subclass_cache_abc_token = token
+
+
+def issubclass2(cls: type | GenericAlias, superclass: type | GenericAlias) -> bool:  # type: ignore
+    """
+    Check if a class is a subclass of a subscripted superclass.
+
+    `TypedDict`s are compared structurally, and `NamedTuple`s are compared to tuple types field by field. Subclasses of
+    generic classes, such as `class Pairs(dict[str, T])`, are compared through the arguments they give their bases, so
+    `Pairs[int]` is a subclass of `Mapping[str, int]`. Unbound `TypeVar`s stand for their bound, or the union of their
+    constraints. All type arguments are treated as covariant.
+
+    Both arguments are normalized into an interned form (unions flattened and deduplicated, `typing` aliases unified
+    with their builtin counterparts, variadic tuples made explicit), and results are memoized per pair of normalized
+    hints, so repeated and overlapping checks are cheap. See `issubclass2_cache_info` and `issubclass2_cache_clear`.
+
+    Args:
+        cls: The class to check.
+        superclass: The type to check against.
+
+    Returns:
+        True if the class is a subclass of the superclass, False otherwise.
+    """
+    if superclass is Any:
+        return True
+    _check_subclass_cache_abc_token()
+    if _check_profiler is not None:
+        return _profile_subclass_check(_is_subclass_node, cls, superclass)
+    return _is_subclass_node(_normalize(cls), _normalize(superclass))
+
+
+def issubclass2_iterative(cls: type | GenericAlias, superclass: type | GenericAlias) -> bool:  # type: ignore
+    """
+    Check if a class is a subclass of a subscripted superclass, without recursing through Python calls.
+
+    This gives the same results as `issubclass2` and shares its result cache, but compares deeply nested hints with an
+    explicit stack, so it works at any depth.
+
+    Args:
+        cls: The class to check.
+        superclass: The type to check against.
+
+    Returns:
+        True if the class is a subclass of the superclass, False otherwise.
+    """
+    if superclass is Any:
+        return True
+    _check_subclass_cache_abc_token()
+    if _check_profiler is not None:
+        return _profile_subclass_check(_is_subclass_node_iterative, cls, superclass)
+    return _is_subclass_node_iterative(_normalize(cls), _normalize(superclass))
+
+
+def _profile_subclass_check(
+    is_subclass_node: Callable[[Any, Any], bool], cls: type | GenericAlias, superclass: type | GenericAlias
+) -> bool:
+    frame = (f"issubclass2({_hint_label(cls)}, {_hint_label(superclass)})", None)
+    return _check_profiler.call(
+        frame, lambda hints: is_subclass_node(_normalize(hints[0]), _normalize(hints[1])), (cls, superclass), False
+    )
+
+
+def issubclass2_cache_info() -> CacheInfo:
+    """Return hit and miss statistics for the `issubclass2` result cache."""
+    return _subclass_cache.info()
+
+
+def issubclass2_cache_clear(maxsize: Optional[int] = None) -> None:
+    """
+    Clear the `issubclass2` result cache and the cache of normalized hints.
+
+    Args:
+        maxsize: If given, the new maximum number of results to keep.
+    """
+    if maxsize is not None:
+        _subclass_cache.maxsize = maxsize
+    _subclass_cache.clear()
+    _node_cache.clear()
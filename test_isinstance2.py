@@ -1,8 +1,27 @@
+import array
+import asyncio
+import io
+import json
+import pickle
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from abc import ABC
+from unittest.mock import Mock
 from typing import *
 
 import pytest
 
-from isinstance2 import GenericAlias, isinstance2, issubclass2, register_instance_checker
+from isinstance2 import (
+    CheckedDict, CheckedList, CheckedSet, GenericAlias, TypeCheckError, check_profile, checked, checked_aiter,
+    checked_iter, checker_cache_info, clear_check_profile, clear_checker_cache, clear_result_cache, compile_checker,
+    compile_plan, disable_check_profiling, disable_parallel_checks, disable_result_cache, enable_check_profiling,
+    enable_parallel_checks, enable_result_cache,
+    instance_checker_registry, isinstance2, isinstance2_explain, isinstance2_iterative,
+    isinstance2_json,
+    isinstance2_many, isinstance2_sampled, issubclass2, issubclass2_cache_clear, issubclass2_cache_info,
+    issubclass2_iterative, profile_checks, register, register_instance_checker, result_cache_info,
+    set_checked_enabled,
+)
 
 
 def test_isinstance2_with_int():
@@ -34,6 +53,114 @@ def test_isinstance2_with_literal():
     assert not isinstance2("world", Literal["hello"])
 
 
+def test_isinstance2_with_literal_checks_types():
+    assert isinstance2(1, Literal[1, "a"])
+    assert not isinstance2(True, Literal[1])
+    assert not isinstance2(1, Literal[True])
+    assert not isinstance2(1.0, Literal[1])
+    assert not isinstance2([1], Literal[1, "a"])
+    assert isinstance2([1, "a", 1], list[Literal[1, "a"]])
+
+
+def test_isinstance2_with_wide_unions():
+    class MyInt(int):
+        pass
+
+    hint = Union[bytes, float, str, MyInt, list[int], dict[str, int], tuple[int, ...], Literal[b"x"], None]
+    assert isinstance2(MyInt(1), hint)
+    assert not isinstance2(1, hint)
+    assert isinstance2([1, 2], hint)
+    assert not isinstance2([1, "2"], hint)
+    assert isinstance2({"a": 1}, hint)
+    assert isinstance2(None, hint)
+    assert isinstance2(b"x", hint)
+    assert not isinstance2(object(), hint)
+    assert isinstance2([None, "a", 1.0, MyInt(2), (1, 2)], list[hint])
+    assert not isinstance2([None, "a", 1.0, 2, (1, 2)], list[hint])
+
+
+def test_isinstance2_with_unions_matches_isinstance():
+    # Objects that override __class__
+    assert isinstance2(Mock(spec=int), int)
+    assert isinstance2(Mock(spec=int), Union[int, str])
+    assert isinstance2(Mock(spec=int), Optional[int])
+    assert not isinstance2(Mock(spec=int), Union[bytes, str])
+
+    # Metaclasses that override __instancecheck__
+    class Weird(type):
+        def __instancecheck__(cls, instance):
+            return instance == 5
+
+    class Five(metaclass=Weird):
+        pass
+
+    assert isinstance2(5, Union[Five, str])
+    assert not isinstance2(6, Union[Five, str])
+
+    # ABCs that gain virtual subclasses after the union has been used
+    class MyABC(ABC):
+        pass
+
+    class X:
+        pass
+
+    assert not isinstance2(X(), Union[MyABC, int])
+    MyABC.register(X)
+    assert isinstance2(X(), Union[MyABC, int])
+    assert isinstance2([X(), 1], list[MyABC | int])
+
+
+def test_isinstance2_with_homogeneous_containers():
+    class MyInt(int):
+        pass
+
+    assert isinstance2([1, 2, MyInt(3)], list[int])
+    assert not isinstance2([1, 2, 3.0], list[int])
+    assert isinstance2([1, "a", MyInt(3)], list[int | str])
+    assert not isinstance2([1, "a", 3.0], list[int | str])
+    assert isinstance2({"a": 1, "b": MyInt(2)}, dict[str, int])
+    assert isinstance2(frozenset({1, 2.0}), frozenset[int | float])
+    assert isinstance2(iter([1, 2]), Iterable[int])
+
+
+def test_isinstance2_with_buffers():
+    assert isinstance2(array.array("i", [1, 2, 3]), Sequence[int])
+    assert not isinstance2(array.array("i", [1, 2, 3]), Sequence[float])
+    assert isinstance2(array.array("d", [1.0]), Sequence[float])
+    assert isinstance2(array.array("d"), Sequence[str])
+    assert isinstance2(array.array("u", "ab"), Sequence[str])
+    assert isinstance2(memoryview(b"abc"), Sequence[int])
+    assert isinstance2(memoryview(b"abc").cast("c"), Sequence[bytes])
+    assert isinstance2(memoryview(array.array("d", [1.0])), Sequence[float])
+    assert not isinstance2(memoryview(b"abc"), Sequence[float])
+
+
+def test_item_type_resolvers_only_cache_buffers():
+    from isinstance2 import _item_type_resolvers
+
+    class Numbers(Sequence):
+        def __getitem__(self, index):
+            return [1, 2][index]
+
+        def __len__(self):
+            return 2
+
+    before = set(_item_type_resolvers)
+    assert isinstance2(Numbers(), Sequence[int])
+    assert isinstance2(iter([1]), Iterable[int])
+    assert set(_item_type_resolvers) == before
+
+
+def test_isinstance2_with_numpy_arrays():
+    numpy = pytest.importorskip("numpy")
+    assert isinstance2(numpy.arange(3.0), Iterable[float])
+    assert not isinstance2(numpy.arange(3.0), Iterable[str])
+    # NumPy's integer scalars are not subclasses of int
+    assert not isinstance2(numpy.arange(3), Iterable[int])
+    assert isinstance2(numpy.array(["a", "b"]), Collection[str])
+    assert isinstance2(numpy.array([1, "a"], dtype=object), Iterable[int | str])
+
+
 def test_isinstance2_with_nested_subscripted_generics():
     assert isinstance2([[(1, 2), (3, 4)], [(5, 6), (7, 8)]], list[list[tuple[int, int]]])
     assert not isinstance2([[(1, "2"), (3, 4)], [(5, 6), (7, 8)]], list[list[tuple[int, int]]])
@@ -83,6 +210,640 @@ def test_isinstance2_with_nested_lists_with_different_types():
     assert isinstance2([[1, 2, 3], ["a", "b", "c"]], list[list[int] | list[str]])
 
 
+def test_compile_checker_matches_isinstance2():
+    hints = [
+        int, Any, list[int], dict[str, list[tuple[int, float]]], tuple[int, ...], tuple[int, str], Literal["a", 1],
+        Union[int, str], Optional[list[int]], set[int | frozenset[int]], Iterable[int], Mapping[str, Any], List,
+    ]
+    objs = [
+        1, "a", None, [1, 2], [1, "2"], {"a": [(1, 2.0)]}, {"a": [(1, 2)]}, (1, 2), (1, "a"), {1, frozenset({2})},
+        range(3), {"a": object()}, [],
+    ]
+    for hint in hints:
+        checker = compile_checker(hint)
+        for obj in objs:
+            assert checker(obj) == isinstance2(obj, hint), (obj, hint)
+
+
+def test_compile_checker_is_cached():
+    assert compile_checker(dict[str, list[int]]) is compile_checker(dict[str, list[int]])
+
+
+def test_compile_checker_sees_new_registrations():
+    T = TypeVar("T")
+
+    class Box(Generic[T]):
+        def __init__(self, value):
+            self.value = value
+
+    with pytest.raises(TypeError):
+        compile_checker(list[Box[int]])
+
+    @register_instance_checker(Box)
+    def _box_is_instance_of(obj: object, arg: type | GenericAlias) -> bool:
+        return isinstance(obj, Box) and isinstance2(obj.value, arg)
+
+    try:
+        checker = compile_checker(list[Box[int]])
+        assert checker([Box(1), Box(2)])
+        assert not checker([Box(1), Box("2")])
+    finally:
+        del instance_checker_registry[Box]
+        clear_checker_cache()
+
+
+def test_isinstance2_resolves_checkers_through_the_mro():
+    class MyList(list[int]):
+        pass
+
+    assert isinstance2(MyList([1, 2]), MyList[int])
+    assert not isinstance2(MyList([1, "2"]), MyList[int])
+    assert not isinstance2([1, 2], MyList[int])
+    assert isinstance2(OrderedDict(a=1), OrderedDict[str, int])
+    assert not isinstance2({"a": 1}, OrderedDict[str, int])
+    assert isinstance2(deque([1, 2]), Deque[int])
+    assert not isinstance2(deque([1, "2"]), deque[int])
+    assert not isinstance2([1, 2], deque[int])
+    assert isinstance2(iter([1, 2]), Iterator[int])
+    assert isinstance2([1, 2], Container[int])
+    assert not isinstance2({"a": 1}, Container[int])
+    assert isinstance2_iterative([MyList([1])], list[MyList[int]])
+
+    # A checker registered for a subclass takes precedence over the one for its base
+    @register_instance_checker(MyList)
+    def _my_list_is_instance_of(obj: object, arg: type | GenericAlias) -> bool:
+        return isinstance(obj, MyList) and len(obj) == 1 and isinstance2(obj[0], arg)
+
+    try:
+        assert not isinstance2(MyList([1, 2]), MyList[int])
+        assert isinstance2(MyList([1]), MyList[int])
+    finally:
+        del instance_checker_registry[MyList]
+        clear_checker_cache()
+    assert isinstance2(MyList([1, 2]), MyList[int])
+
+
+def test_isinstance2_with_custom_registry():
+    T = TypeVar("T")
+
+    class Box(Generic[T]):
+        def __init__(self, value):
+            self.value = value
+
+    class SubBox(Box[T]):
+        pass
+
+    registry = instance_checker_registry.copy()
+
+    @register(registry, Box)
+    def _box_is_instance_of(obj: object, arg: type | GenericAlias) -> bool:
+        return isinstance(obj, Box) and isinstance2(obj.value, arg)
+
+    with pytest.raises(TypeError):
+        isinstance2(Box(1), Box[int])
+    assert isinstance2(Box(1), Box[int], registry)
+    assert not isinstance2(Box("1"), Box[int], registry)
+    assert isinstance2(SubBox(1), SubBox[int], registry)
+    assert not isinstance2(Box(1), SubBox[int], registry)
+    assert compile_checker(list[Box[int]], registry) is compile_checker(list[Box[int]], registry)
+
+
+def test_compile_checker_cache_is_bounded():
+    clear_checker_cache()
+    for i in range(2_000):
+        assert compile_checker(Literal[i])(i)
+    info = checker_cache_info()
+    assert info.currsize <= info.maxsize
+
+
+def test_result_cache():
+    hint = tuple[tuple[str, int], ...]
+    config = (("a", 1), ("b", 2))
+    assert result_cache_info() == (0, 0, 0, 0)
+    enable_result_cache(maxsize=2)
+    try:
+        assert isinstance2(config, hint)
+        assert isinstance2(config, hint)
+        assert not isinstance2(config, tuple[tuple[str, str], ...])
+        assert result_cache_info().hits == 1
+        assert result_cache_info().currsize == 2
+
+        # Objects that could change are never cached
+        clear_result_cache()
+        mutable = (("a", 1), ["b", 2])
+        assert isinstance2(mutable, tuple[tuple[str, int] | list[str | int], ...])
+        mutable[1].append(None)
+        assert not isinstance2(mutable, tuple[tuple[str, int] | list[str | int], ...])
+        assert result_cache_info().currsize == 0
+
+        # Registering a virtual subclass invalidates cached results
+        class MyABC(ABC):
+            pass
+
+        assert not isinstance2(config, tuple[MyABC, ...])
+        MyABC.register(tuple)
+        assert isinstance2(config, tuple[MyABC, ...])
+    finally:
+        disable_result_cache()
+    assert result_cache_info() == (0, 0, 0, 0)
+
+
+def test_checked_containers():
+    events = CheckedList(list[int], [1, 2])
+    events.append(3)
+    events += [4]
+    events[0:1] = [0]
+    assert events == [0, 2, 3, 4]
+    for mutate in (
+        lambda: events.append("5"), lambda: events.insert(0, None), lambda: events.extend([5, "6"]),
+        lambda: events.__setitem__(0, 1.0), lambda: events.__setitem__(slice(0, 1), ["0"]),
+    ):
+        with pytest.raises(TypeCheckError):
+            mutate()
+    assert events == [0, 2, 3, 4]
+    with pytest.raises(TypeCheckError):
+        CheckedList(list[int], [1, "2"])
+
+    state = CheckedDict(dict[str, list[int]], {"a": events})
+    state["b"] = CheckedList(list[int])
+    state.setdefault("c", [1])
+    state |= {"d": []}
+    for mutate in (lambda: state.__setitem__(1, []), lambda: state.update(e=[None]), lambda: state.setdefault("f")):
+        with pytest.raises(TypeCheckError):
+            mutate()
+    assert set(state) == {"a", "b", "c", "d"}
+
+    tags = CheckedSet(set[str], {"a"})
+    tags.add("b")
+    tags |= {"c"}
+    with pytest.raises(TypeCheckError):
+        tags.update({"d"}, {1})
+    with pytest.raises(TypeCheckError):
+        tags ^= {None}
+    assert tags == {"a", "b", "c"}
+
+    # Checked containers are accepted without looking at their items, if they were created for the same hint
+    assert isinstance2(events, list[int]) and isinstance2(events, List[int])
+    assert isinstance2(state, dict[str, list[int]]) and isinstance2(tags, set[str])
+    assert isinstance2(events.copy(), list[int])
+    assert pickle.loads(pickle.dumps(state)) == state
+    list.append(events, "bypassed")
+    assert isinstance2(events, list[int])
+    # ...and checked as usual against other hints
+    assert not isinstance2(events, Sequence[int])
+    assert not isinstance2(tags, set[int])
+
+
+def test_isinstance2_sampled():
+    assert isinstance2_sampled([1, 2, 3], list[int], sample_size=3) == (True, True)
+    assert isinstance2_sampled([1, 2, "3"], list[int], sample_size=3) == (False, True)
+
+    payload = list(range(1_000))
+    payload[1] = "oops"
+    result = isinstance2_sampled(payload, list[int], sample_size=10)
+    assert result == (True, False)
+    assert result
+    payload[100] = "oops"
+    assert not isinstance2_sampled(payload, list[int], sample_size=10)
+
+    # Sampling is reproducible with a seed
+    payload = [{"a": [i, i]} if i % 7 else {"a": [i, str(i)]} for i in range(1_000)]
+    results = {isinstance2_sampled(payload, list[dict[str, list[int]]], 5, seed=1234) for _ in range(5)}
+    assert len(results) == 1
+    assert not isinstance2_sampled(payload, list[dict[str, list[int]]], 500, seed=1234).result
+
+    # Unsized iterables are sampled from the front
+    assert isinstance2_sampled((i for i in range(10)), Iterable[int], sample_size=10) == (True, True)
+    assert isinstance2_sampled((i for i in range(11)), Iterable[int], sample_size=10) == (True, False)
+    assert isinstance2_sampled({"a": 1, "b": "2"}, dict[str, int] | dict[str, str], 1) == (True, False)
+
+
+def test_isinstance2_sampled_budget():
+    payload = [[[1] * 100] * 100] * 99 + [[["not an int"] * 100] * 100]
+    # sample_size alone would allow 100 ** 3 checks; the budget caps the total
+    result = isinstance2_sampled(payload, list[list[list[int]]], sample_size=100, budget=500)
+    assert result == (True, False)
+
+    payload = [[1, 2], [3, "4"]]
+    assert isinstance2_sampled(payload, list[list[int]], budget=4) == (True, False)
+    assert isinstance2_sampled(payload, list[list[int]], budget=7) == (False, True)
+    assert isinstance2_sampled(payload, list[list[int]], budget=100) == (False, True)
+    with pytest.raises(ValueError):
+        isinstance2_sampled(payload, list[list[int]], budget=0)
+
+
+def test_isinstance2_many():
+    hint = dict[str, list[int]]
+    objs = [{"a": [1, 2]}, {"a": ["b"]}, {}, [1], {"b": []}] * 7
+    expected = bytearray(isinstance2(obj, hint) for obj in objs)
+    assert isinstance2_many(objs, hint) == expected
+    assert isinstance2_many(iter(objs), hint, failures=True) == [i for i, passed in enumerate(expected) if not passed]
+    for executor in ("thread", "process", "auto"):
+        assert isinstance2_many(objs, hint, executor=executor, max_workers=2, chunk_size=3) == expected
+    assert isinstance2_many([], hint, executor="thread") == bytearray()
+    with pytest.raises(ValueError):
+        isinstance2_many(objs, hint, chunk_size=0)
+
+
+def test_parallel_checks():
+    size = 40_000
+    numbers = list(range(size))
+    objs = [
+        numbers, numbers + ["x"], ["x"] + numbers, tuple(numbers), {str(i): float(i) for i in range(size)},
+        {**{str(i): float(i) for i in range(size)}, 1: 1.0}, "ab" * size, set(numbers), [1, "x"],
+        CheckedList(list[int], numbers),
+    ]
+    hints = [list[int], Sequence[int], tuple[int, ...], dict[str, float], Mapping[str, float], list[str], Sequence[str]]
+    expected = [[isinstance2(obj, hint) for hint in hints] for obj in objs]
+    for executor in ("thread", "process", "auto"):
+        enable_parallel_checks(threshold=10, executor=executor, max_workers=2)
+        try:
+            assert [[isinstance2(obj, hint) for hint in hints] for obj in objs] == expected, executor
+        finally:
+            disable_parallel_checks()
+    with pytest.raises(ValueError):
+        enable_parallel_checks(threshold=0)
+    with pytest.raises(ValueError):
+        enable_parallel_checks(executor="fibers")
+
+
+
+def test_isinstance2_json(tmp_path):
+    documents = [
+        '[1, 2, 3]', '[1, "2", 3.5, null]', '{"a": [1, {"b": true}], "c": -1.5e3}', '[[1, "x"], [2, "y"]]',
+        '[{"id": 1, "name": "a\\u00e9\\n"}, {"id": 2, "name": null}]', '{}', '[]', '"text"', '12', 'null',
+        '{"movie": {"title": "Blade Runner", "year": 1982}}',
+    ]
+    hints = [
+        list[int], list[int | str | float | None], dict[str, Any], list[tuple[int, str]], list[list[int | str]],
+        list[dict[str, int | str | None]], dict[str, list[int] | int], Sequence[int], Mapping[str, Movie],
+        Iterable[str], list[int] | dict[str, int], list[list[int]] | list[list[int | str]], str, int, type(None),
+    ]
+    for document in documents:
+        obj = json.loads(document)
+        for hint in hints:
+            expected = isinstance2(obj, hint)
+            for chunk_size in (1, 3, 1 << 16):
+                result = isinstance2_json(document.encode(), hint, chunk_size=chunk_size)
+                assert bool(result) == expected, (document, hint, chunk_size)
+                assert (result.failure is None) == expected
+            assert bool(isinstance2_json(io.StringIO(document), hint, chunk_size=2)) == expected
+
+    result = isinstance2_json(b'[{"a": [1, 2]}, {"a": [3, "4"]}]', list[dict[str, list[int]]])
+    assert result == (False, ("[1]['a'][1]", int, str))
+    assert isinstance2_json(b'{"a": 1}', list[int]).failure == ("", list[int], dict)
+
+    path = tmp_path / "document.json"
+    path.write_text(json.dumps([{"id": i, "tags": ["a", "b"]} for i in range(1_000)]))
+    for use_mmap in (False, True):
+        assert isinstance2_json(path, list[dict[str, int | list[str]]], chunk_size=100, use_mmap=use_mmap)
+        assert not isinstance2_json(str(path), list[dict[str, int]], use_mmap=use_mmap)
+    (tmp_path / "empty.json").write_bytes(b"")
+    with pytest.raises(ValueError):
+        isinstance2_json(tmp_path / "empty.json", Any, use_mmap=True)
+
+    for invalid in (b'[1, 2', b'[1 2]', b'{"a" 1}', b'[1] 2', b'"abc', b'[tru]', b'{1: 2}'):
+        with pytest.raises(ValueError):
+            isinstance2_json(invalid, Any, chunk_size=2)
+    with pytest.raises(ValueError):
+        isinstance2_json(b"[]", Any, chunk_size=0)
+
+
+
+
+def test_isinstance2_explain():
+    payload = [{"items": [1, 2]}] * 3 + [{"items": [*range(17), (1, "a")]}]
+    assert isinstance2_explain(payload, list[dict[str, list[int | tuple[int, int]]]]) == [
+        ("[3]['items'][17][1]", int, str)
+    ]
+    assert isinstance2_explain([1, "a", 2, None], list[int], max_failures=5) == [
+        ("[1]", int, str), ("[3]", int, type(None))
+    ]
+    assert isinstance2_explain({"a": 1, 2: 3}, dict[str, int], max_failures=5) == [("[2]", str, int)]
+    assert isinstance2_explain((1, 2), tuple[int, str, int]) == [("", tuple[int, str, int], tuple)]
+    assert isinstance2_explain([[1], None, "x"], list[list[int] | None]) == [("[2]", list[int] | None, str)]
+    assert isinstance2_explain([{"title": "x", "year": "1982"}, {"year": 1}], list[Movie], max_failures=5) == [
+        ("[0]['year']", int, str), ("[1]", Movie, dict)
+    ]
+    assert isinstance2_explain([Point(1, True), Point(1, 2)], list[Point]) == [("[1].y", bool, int)]
+    assert str(isinstance2_explain([1, "a"], list[int])[0]) == (
+        "Value at [1] is not an instance of <class 'int'>; got <class 'str'>"
+    )
+    with pytest.raises(ValueError):
+        isinstance2_explain([], list[int], max_failures=0)
+
+    # Explaining agrees with the boolean check
+    objs = [
+        [1, 2], [1, "2"], {"a": [1]}, {"a": ["b"]}, {1: 2}, (1, "a"), (1, 2, 3), [(1, "a"), (2, 3)], [], None, "s",
+        {"title": "x"}, [{"title": 1}], CheckedList(list[int], [1]), {1, 2}, [[1, None], [2]],
+    ]
+    hints = [
+        list[int], list[int | str], dict[str, list[int]], Mapping[str, Sequence[int]], tuple[int, str],
+        tuple[int, ...], list[tuple[int, str]], Iterable[int] | None, list[Movie], Movie, set[int],
+        list[list[int | None]], Sequence[int], str | list[int],
+    ]
+    for obj in objs:
+        for hint in hints:
+            failures = isinstance2_explain(obj, hint, max_failures=3)
+            assert (not failures) == isinstance2(obj, hint), (obj, hint)
+            assert len(failures) <= 3
+
+
+def test_check_profiling():
+    hint = list[dict[str, list[int | str]]]
+    with profile_checks() as profile:
+        assert compile_plan(hint).check.__qualname__.startswith("_profile_plan")
+        assert not isinstance2([{"a": [1, "x"]}, {"b": [None]}], hint)
+        assert issubclass2(list[int], Sequence[int])
+    stats = {stats.hint: stats for stats in profile.stats()}
+    outer = stats["list[dict[str, list[int | str]]]"]
+    assert (outer.checker, outer.calls, outer.elements, outer.failures) == ("list", 1, 2, 1)
+    assert outer.time_ns >= outer.self_time_ns >= 0
+    assert stats["dict[str, list[int | str]]"].calls == 2
+    assert stats["dict[str, list[int | str]]"].failures == 1
+    assert stats["list[int | str]"].elements == 3
+    assert stats["issubclass2(list[int], typing.Sequence[int])"].calls == 1
+    assert "list[dict[str, list[int | str]]];dict[str, list[int | str]];list[int | str] " in profile.collapsed_stacks()
+    assert {metric["hint"] for metric in profile.metrics()} == set(stats)
+
+    # Profiling is off outside of the block, and the plans are no longer instrumented
+    assert not compile_plan(hint).check.__qualname__.startswith("_profile_plan")
+    assert isinstance2([{"a": [1]}], hint)
+    assert check_profile().stacks == {}
+
+    enable_check_profiling()
+    try:
+        assert isinstance2([{"a": [1]}], hint)
+        with profile_checks() as inner:
+            assert isinstance2([{"a": [1]}], hint)
+        assert inner.stats()[0].calls == 1
+        # Statistics collected in the block are also added to those collected outside of it
+        assert check_profile().stats()[0].calls == 2
+        clear_check_profile()
+        assert check_profile().stacks == {}
+    finally:
+        disable_check_profiling()
+    assert check_profile().stacks == {}
+
+
+def test_checked_iter():
+    items = checked_iter((("a", i) for i in range(3)), Iterable[tuple[str, int]])
+    assert next(items) == ("a", 0)
+    assert list(items) == [("a", 1), ("a", 2)]
+
+    items = checked_iter(iter([1, 2, "3", 4]), Iterator[int])
+    assert next(items) == 1
+    assert next(items) == 2
+    with pytest.raises(TypeCheckError):
+        next(items)
+
+    errors = []
+    items = checked_iter([1, "2", 3], list[int], on_error=lambda index, item: errors.append((index, item)))
+    assert list(items) == [1, "2", 3]
+    assert errors == [(1, "2")]
+
+    with pytest.raises(TypeCheckError):
+        checked_iter((i for i in range(3)), list[int])
+    with pytest.raises(TypeError):
+        checked_iter([1], int)
+
+
+def test_checked_iter_closes_source():
+    closed = []
+
+    def numbers():
+        try:
+            yield from range(10)
+        finally:
+            closed.append(True)
+
+    items = checked_iter(numbers(), Iterator[int])
+    assert next(items) == 0
+    items.close()
+    assert closed == [True]
+
+    async def async_numbers():
+        try:
+            for i in range(10):
+                yield i
+        finally:
+            closed.append(True)
+
+    async def take_one():
+        items = checked_aiter(async_numbers(), AsyncIterator[int])
+        assert await items.__anext__() == 0
+        await items.aclose()
+
+    asyncio.run(take_one())
+    assert closed == [True, True]
+
+
+def test_checked_aiter():
+    async def numbers():
+        for item in [1, 2, "3"]:
+            yield item
+
+    async def collect(aiterable):
+        return [item async for item in aiterable]
+
+    errors = []
+    items = checked_aiter(numbers(), AsyncIterator[int], on_error=lambda index, item: errors.append(index))
+    assert asyncio.run(collect(items)) == [1, 2, "3"]
+    assert errors == [2]
+
+    with pytest.raises(TypeCheckError):
+        asyncio.run(collect(checked_aiter(numbers(), AsyncIterable[int])))
+
+
+def test_checked():
+    @checked
+    def scale(
+        values: list[float], factor: float = 1, *extra: int, label: str | None = None, **options: bool
+    ) -> list[float]:
+        return [value * factor for value in values] if label != "bad" else ["bad"]
+
+    assert scale([1.0], 2.0, 1, 2, label="x", verbose=True) == [2.0]
+    assert scale(values=[1.0], factor=2.0) == [2.0]
+    for args, kwargs in [
+        (([1],), {}), (([1.0], "2"), {}), (([1.0], 2.0, "3"), {}), (([1.0],), {"label": 1}),
+        (([1.0],), {"verbose": 1}), ((), {"values": 1.0}), (([1.0],), {"label": "bad"}),
+    ]:
+        with pytest.raises(TypeCheckError):
+            scale(*args, **kwargs)
+
+    @checked
+    def count(n: int) -> Generator[int, None, str]:
+        yield from range(n)
+        yield "done"
+        return "finished"
+
+    numbers = count(2)
+    assert next(numbers) == 0 and next(numbers) == 1
+    with pytest.raises(TypeCheckError):
+        next(numbers)
+
+    @checked
+    def echo() -> Generator[int, int, None]:
+        received = yield 0
+        while received is not None:
+            received = yield received
+
+    echoes = echo()
+    assert next(echoes) == 0
+    assert echoes.send(5) == 5
+    with pytest.raises(TypeCheckError):
+        echoes.send("6")
+
+    @checked
+    async def double(value: int) -> int:
+        return value * 2 if value else "zero"
+
+    @checked
+    async def agen() -> AsyncIterator[int]:
+        yield 1
+        yield "2"
+
+    async def run():
+        assert await double(2) == 4
+        with pytest.raises(TypeCheckError):
+            await double(0)
+        items = agen()
+        assert await items.__anext__() == 1
+        with pytest.raises(TypeCheckError):
+            await items.__anext__()
+
+    asyncio.run(run())
+
+    # Forward references are resolved on the first call
+    @checked
+    def make() -> "LaterDefined":
+        return LaterDefined()
+
+    class LaterDefined:
+        pass
+
+    globals()["LaterDefined"] = LaterDefined
+    try:
+        assert isinstance(make(), LaterDefined)
+    finally:
+        del globals()["LaterDefined"]
+
+    set_checked_enabled(False)
+    try:
+        assert scale([1], "2") == ["2"]
+
+        def plain(x: int) -> int:
+            return x
+
+        assert checked(plain) is plain
+    finally:
+        set_checked_enabled(True)
+
+
+class Movie(TypedDict):
+    title: str
+    year: NotRequired[int]
+
+
+class Film(TypedDict):
+    title: str
+    year: int
+    rating: float
+
+
+@dataclass
+class TreeNode:
+    value: int
+    children: "list[TreeNode]" = field(default_factory=list)
+
+
+class Point(NamedTuple):
+    x: int
+    y: bool
+
+
+def test_isinstance2_with_records():
+    assert isinstance2({"title": "Up"}, Movie)
+    assert isinstance2({"title": "Up", "year": 2009, "rating": 8.3}, Movie)
+    assert not isinstance2({"title": "Up", "year": "2009"}, Movie)
+    assert not isinstance2({"year": 2009}, Movie)
+    assert not isinstance2([("title", "Up")], Movie)
+    assert isinstance2({"a": [{"title": "Up"}]}, dict[str, list[Movie]])
+    assert not isinstance2({"a": [{"title": 1}]}, dict[str, list[Movie | None]])
+
+    assert isinstance2(TreeNode(1, [TreeNode(2, [TreeNode(3)])]), TreeNode)
+    assert not isinstance2(TreeNode(1, [TreeNode(2, [TreeNode("3")])]), TreeNode)
+    assert not isinstance2(TreeNode(1, [None]), TreeNode | None)
+    assert isinstance2_iterative([TreeNode(1)], list[TreeNode])
+
+    assert isinstance2(Point(1, True), Point)
+    assert not isinstance2(Point(1, 2), Point)
+    assert not isinstance2((1, True), Point)
+    assert isinstance2([Point(1, False)], list[Point | int])
+
+
+def test_issubclass2_with_records():
+    assert issubclass2(Film, Movie)
+    assert not issubclass2(Movie, Film)
+    assert issubclass2(list[Film], Sequence[Movie | None])
+    assert issubclass2(Movie, dict) and issubclass2(Movie, Mapping[Any, Any])
+    assert not issubclass2(Movie, Mapping[str, int])
+    assert not issubclass2(dict[str, int], Movie)
+
+    assert issubclass2(Point, tuple[int, int])
+    assert issubclass2(Point, tuple[int, ...]) and issubclass2(Point, Sequence[int])
+    assert not issubclass2(Point, tuple[bool, ...])
+    assert not issubclass2(tuple[int, bool], Point)
+    assert issubclass2_iterative(Point, tuple[int, int])
+
+
+def test_isinstance2_iterative_matches_isinstance2():
+    hints = [
+        int, list[int], dict[str, list[tuple[int, float]]], tuple[int, ...], tuple[int, str], Literal["a", 1],
+        Optional[list[int]], set[int | frozenset[int]], Iterable[int], Mapping[str, Any], List,
+        list[list[int] | dict[str, tuple[int, ...]]],
+    ]
+    objs = [
+        1, "a", None, [1, 2], [1, "2"], {"a": [(1, 2.0)]}, {"a": [(1, 2)]}, (1, 2), (1, "a"), {1, frozenset({2})},
+        [[1], {"a": (1, 2)}], [[1], {"a": (1, "2")}], [],
+    ]
+    for hint in hints:
+        for obj in objs:
+            assert isinstance2_iterative(obj, hint) == isinstance2(obj, hint), (obj, hint)
+
+
+def test_iterative_engines_with_deep_nesting():
+    depth = 5_000
+    hint, obj = int, 1
+    for _ in range(depth):
+        hint, obj = list[hint] | None, [obj]
+    assert isinstance2_iterative(obj, hint)
+    assert not isinstance2_iterative(obj, list[hint])
+
+    bad = [obj]
+    for _ in range(depth):
+        bad = bad[0]
+    bad[0] = "not an int"
+    assert not isinstance2_iterative(obj, hint)
+
+    assert issubclass2_iterative(hint, hint | str)
+    assert issubclass2_iterative(list[hint], Sequence[hint])
+    assert not issubclass2_iterative(list[hint], Sequence[str])
+
+
+def test_issubclass2_iterative_matches_issubclass2():
+    hints = [
+        int, bool, str, list[int], list[bool], Sequence[int], Iterable[int | str], tuple[int, ...], tuple[bool, int],
+        dict[str, int], Mapping[str, int | str], Optional[int], Literal[1, 2],
+    ]
+    for cls in hints:
+        for superclass in hints:
+            issubclass2_cache_clear()
+            expected = issubclass2(cls, superclass)
+            issubclass2_cache_clear()
+            assert issubclass2_iterative(cls, superclass) == expected, (cls, superclass)
+
+
 def test_issubclass2_with_int():
     assert issubclass2(int, int)
     assert not issubclass2(int, str)
@@ -145,7 +906,6 @@ def test_issubclass2_with_complex_unions():
     assert not issubclass2(set[int], set[str] | frozenset[int])
 
 
-@pytest.mark.xfail(reason="Support for custom classes with generic subclasses is not implemented yet")
 def test_issubclass2_with_custom_classes_with_generic_subclasses():
     class MyList(list[int]):
         pass
@@ -154,6 +914,79 @@ def test_issubclass2_with_custom_classes_with_generic_subclasses():
     assert not issubclass2(MyList, list[str])
 
 
+K = TypeVar("K")
+V = TypeVar("V")
+Number_ = TypeVar("Number_", bound=float)
+StrOrBytes = TypeVar("StrOrBytes", str, bytes)
+
+
+class MyMapping(Mapping[K, V]):
+    def __init__(self, items: dict):
+        self.items_ = items
+
+    def __getitem__(self, key):
+        return self.items_[key]
+
+    def __iter__(self):
+        return iter(self.items_)
+
+    def __len__(self):
+        return len(self.items_)
+
+
+class StrMapping(MyMapping[str, V]):
+    pass
+
+
+class Pairs(dict[str, V]):
+    pass
+
+
+class Swapped(Generic[K, V], dict[V, K]):
+    pass
+
+
+def test_issubclass2_with_user_generics():
+    for issubclass2_ in (issubclass2, issubclass2_iterative):
+        assert issubclass2_(MyMapping[str, int], Mapping[str, int | float])
+        assert not issubclass2_(MyMapping[str, int], Mapping[str, str])
+        assert issubclass2_(MyMapping[str, int], Iterable[str])
+        assert not issubclass2_(MyMapping[str, int], Iterable[int])
+        assert issubclass2_(StrMapping[int], MyMapping[str, int])
+        assert not issubclass2_(StrMapping[int], MyMapping[int, int])
+        assert issubclass2_(StrMapping[bool], Mapping[str, int])
+        assert issubclass2_(Pairs[int], dict[str, int])
+        assert not issubclass2_(Pairs[int], Mapping[str, str])
+        assert issubclass2_(Swapped[int, str], dict[str, int])
+        assert not issubclass2_(Swapped[int, str], dict[int, str])
+        assert issubclass2_(MyMapping, Mapping[Any, Any])
+        assert not issubclass2_(MyMapping, Mapping[str, int])
+        assert not issubclass2_(list[int], Pairs[int])
+
+        # Unbound TypeVars stand for their bounds or constraints
+        assert issubclass2_(list[Number_], list[float])
+        assert not issubclass2_(list[Number_], list[int])
+        assert issubclass2_(list[StrOrBytes], Sequence[str | bytes])
+        assert not issubclass2_(list[StrOrBytes], Sequence[str])
+
+
+def test_isinstance2_with_user_generics_and_typevars():
+    assert isinstance2(Pairs(a=1), Pairs[int])
+    assert not isinstance2(Pairs(a="1"), Pairs[int])
+    assert isinstance2(Swapped({"a": 1}), Swapped[int, str])
+    assert not isinstance2(Swapped({"a": 1}), Swapped[str, int])
+    assert isinstance2(MyMapping({"a": 1}), MyMapping[str, int])
+    assert not isinstance2(MyMapping({"a": "1"}), MyMapping[str, int])
+
+    assert isinstance2(1.5, Number_)
+    assert not isinstance2("1.5", Number_)
+    assert isinstance2([1.5, 2.0], list[Number_])
+    assert isinstance2(b"x", StrOrBytes)
+    assert not isinstance2(1, StrOrBytes)
+    assert isinstance2(object(), TypeVar("T"))
+    assert isinstance2_explain(["a", 1], list[StrOrBytes]) == [("[1]", str | bytes, int)]
+
+
 @pytest.mark.xfail(reason="Support for recursive generics is not implemented yet")
 def test_issubclass2_with_recursive_generics():
     T = TypeVar("T")
@@ -180,6 +1013,47 @@ def test_issubclass2_with_dictionaries_with_subscripted_generics():
     assert issubclass2(dict[str, int | str], dict[str, Union[int, str]])
 
 
+def test_issubclass2_with_normalized_hints():
+    assert issubclass2(List[int], list[int])
+    assert issubclass2(list[int], List[int])
+    assert issubclass2(Optional[int], Union[None, int])
+    assert issubclass2(Union[int, Union[str, int]], int | str)
+    assert issubclass2(Tuple[int, ...], tuple[int, ...])
+    assert issubclass2(tuple[int, int], Iterable[int])
+    assert not issubclass2(tuple[int, ...], Iterable[str])
+    assert issubclass2(dict[str, int], Iterable[str])
+    assert not issubclass2(dict[str, int], Iterable[int])
+
+
+def test_issubclass2_cache():
+    issubclass2_cache_clear()
+    assert issubclass2(dict[str, list[int]], Mapping[str, Iterable[int | str]])
+    misses = issubclass2_cache_info().misses
+    assert issubclass2(Dict[str, List[int]], Mapping[str, Iterable[Union[str, int]]])
+    info = issubclass2_cache_info()
+    assert info.misses == misses
+    assert info.hits > 0
+    issubclass2_cache_clear(maxsize=2)
+    assert issubclass2(dict[str, list[int]], Mapping[str, Iterable[int | str]])
+    info = issubclass2_cache_info()
+    assert info.currsize <= info.maxsize == 2
+    issubclass2_cache_clear(maxsize=4096)
+
+
+def test_issubclass2_sees_abc_registrations():
+    class MyABC(ABC):
+        pass
+
+    class Y:
+        pass
+
+    assert not issubclass2(list[Y], list[MyABC])
+    assert not issubclass2_iterative(list[Y], Sequence[MyABC])
+    MyABC.register(Y)
+    assert issubclass2(list[Y], list[MyABC])
+    assert issubclass2_iterative(list[Y], Sequence[MyABC])
+
+
 def test_issubclass2_with_str_and_nongeneric():
     assert issubclass2(str, str)
     assert not issubclass2(str, int)